@@ -2,12 +2,27 @@
 This module provides the MPI interface, mimicking the mpi4py package.
 """
 
-from .constants import ANY_TAG, ANY_SOURCE
-from .core import COMM_WORLD, Status
+from .constants import ANY_TAG, ANY_SOURCE, UNDEFINED, COMM_TYPE_SHARED, IN_PLACE
+from .core import COMM_WORLD, Status, Request, Op, SUM, PROD, MAX, MIN, LAND, LOR, REPLACE, NO_OP, Win, ProcFailed
 
 __all__ = [
     'COMM_WORLD',
     'Status',
+    'Request',
+    'Op',
+    'SUM',
+    'PROD',
+    'MAX',
+    'MIN',
+    'LAND',
+    'LOR',
+    'REPLACE',
+    'NO_OP',
+    'Win',
+    'ProcFailed',
     'ANY_TAG',
     'ANY_SOURCE',
+    'UNDEFINED',
+    'COMM_TYPE_SHARED',
+    'IN_PLACE',
 ]
@@ -2,9 +2,18 @@ __all__ = [
     'DEBUG',
     'ANY_SOURCE',
     'ANY_TAG',
+    'UNDEFINED',
+    'COMM_TYPE_SHARED',
     'BCAST_TAG',
     'GATHER_TAG',
     'BARRIER_TAG',
+    'SCATTER_TAG',
+    'REDUCE_TAG',
+    'ALLTOALL_TAG',
+    'RING_TAG',
+    'WIN_TAG',
+    'WIN_REPLY_TAG',
+    'IN_PLACE',
     'AUTHKEY_LENGTH',
 ]
 
@@ -15,10 +24,19 @@ DEBUG = bool(os.environ.get('DLP_MPI_DEBUG', False))
 # MPI constants
 ANY_SOURCE = -2
 ANY_TAG = -1
+UNDEFINED = -32766  # Color for Split, the rank gets no communicator
+COMM_TYPE_SHARED = 1  # Split_type: The ranks on the same host
+IN_PLACE = -32767  # sendbuf of Allreduce: Use the recvbuf as input
 
 # Custom constants
 BCAST_TAG = -3
 GATHER_TAG = -4
 BARRIER_TAG = -5
+SCATTER_TAG = -6
+REDUCE_TAG = -7
+ALLTOALL_TAG = -8
+RING_TAG = -9
+WIN_TAG = -10  # Fetch_and_op request to the target of a window
+WIN_REPLY_TAG = -11
 
 AUTHKEY_LENGTH = 64
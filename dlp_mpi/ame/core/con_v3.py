@@ -7,14 +7,24 @@ Hence, some code has its origin in the tutorial.
 """
 import os
 import pickle
+import collections
+import contextlib
+import ctypes
+import itertools
 import struct
 import sys
 import time
 import selectors
+import shutil
 import socket
+import tempfile
+import threading
 import base64
 import hashlib
+import hmac
+import mmap
 import types
+import weakref
 
 from ..constants import *
 from .logger import info
@@ -24,6 +34,14 @@ class SocketClosed(Exception):
     pass
 
 
+class ProcFailed(Exception):
+    """
+    A rank, that the caller waits for or sends to, has closed its
+    connections, e.g. the process was killed. Raised by the communicators,
+    that acknowledge failures (Ack_failed).
+    """
+
+
 class Mixin:
     def __init__(self, host, port, rank, size, debug=False):
         self.host = host
@@ -50,62 +68,1111 @@ class Mixin:
     # _MAX_RECV = 16777216  # = 2**24  # With this, get many packages of length 65483
 
     @classmethod
-    def recv_nbytes(cls, sock: 'socket.SocketType', length):
+    def recv_into(cls, sock: 'socket.SocketType', buffer):
+        """
+        Fill the whole buffer with data from the socket.
+        The buffer is usually a preallocated bytearray, i.e., the data is
+        written directly to its final memory location.
+        """
+        view = memoryview(buffer).cast('B')
+        length = view.nbytes
         read = 0
         try:
-            view = memoryview(bytearray(length))
             while length:
                 recv_length = sock.recv_into(view[read:], min(length, cls._MAX_RECV))
                 if recv_length == 0:
                     raise SocketClosed("Socket closed")
                 length -= recv_length
                 read += recv_length
-            return view.tobytes()  # convert to bytes
+            return buffer
         except KeyboardInterrupt as e:
             raise KeyboardInterrupt(f"Waiting for {length} more bytes. Got {read} bytes.") from e
 
-    _HEADER_FMT = 'Qi'
+    @classmethod
+    def recv_nbytes(cls, sock: 'socket.SocketType', length):
+        return bytes(cls.recv_into(sock, bytearray(length)))
+
+    @classmethod
+    def sendmsg_all(cls, sock: 'socket.SocketType', buffers):
+        """
+        Like sock.sendall, but for a list of buffers, i.e., the buffers
+        are not concatenated before they are sent.
+        """
+        pending = PendingFrame(buffers)
+        while not pending.done:
+            pending.advance(sock.sendmsg(pending.iov()))
+
+    # '=': Standard sizes without alignment. Otherwise, the 'Q' of the
+    # buffer lengths, that follow the 20 bytes, would be padded.
+    _HEADER_FMT = '=QiII'
     _HEADER_FMT_SIZE = struct.calcsize(_HEADER_FMT)
     # i int (4 bytes)
     # I unsigned int (4 bytes)
     # q long long (8 bytes)
     # Q unsigned long long (8 bytes)
+    #
+    # A frame on the wire:
+    #   header: (length of the pickle body, tag, context, number of out-of-band buffers)
+    #   the length of each out-of-band buffer ('Q' each)
+    #   pickle body
+    #   out-of-band buffers
+    #
+    # The context identifies the communicator, i.e. all communicators share
+    # the sockets.
+    #
+    # When the frame is in a shared memory segment, the _SHM_FLAG bit of the
+    # number of buffers is set and the pickle body and the buffers are
+    # replaced by the index of the receiver ('H'), the number of receivers
+    # ('H') and the name of the segment ('B' length + name).
+    #
+    # None, booleans and ints, that fit in 64 bits, are not pickled. The
+    # _INLINE_FLAG bit of the number of buffers is set, the low bits are
+    # the type (_INLINE_TYPES) and the length field is the value of the int,
+    # i.e. the frame is only the header. split_managed and map_unordered
+    # exchange mostly such messages (task indices and None).
+    _INLINE_FLAG = 1 << 30
+    _INLINE_TYPES = (type(None), bool, int)
+
+    # Contiguous buffers (e.g. numpy arrays) that are at least this large are
+    # not copied into the pickle body. They are sent as separate buffers
+    # straight from the memory of the object (pickle protocol 5).
+    _OOB_THRESHOLD = 65536
 
     @classmethod
-    def msg_recv(cls, sock):
-        length, tag = struct.unpack(cls._HEADER_FMT, cls.recv_nbytes(sock, cls._HEADER_FMT_SIZE))
-        if tag not in [BARRIER_TAG]:
-            data = pickle.loads(cls.recv_nbytes(sock, length))
+    def encode(cls, tag, data, context=0):
+        """
+        Serialize data to a frame, i.e., a list of bytes-like objects.
+        Large buffers of data are not copied, the frame references them.
+
+        >>> import numpy as np
+        >>> a = np.arange(100_000)
+        >>> frame = Mixin.encode(1, {'a': a})
+        >>> len(frame), np.shares_memory(np.frombuffer(frame[-1], dtype=a.dtype), a)
+        (3, True)
+        >>> len(Mixin.encode(1, {'a': np.arange(10)}))
+        2
+        >>> [len(b''.join(Mixin.encode(1, data))) for data in [None, True, -3, 2**70]]
+        [20, 20, 20, 43]
+        """
+        if type(data) in cls._INLINE_TYPES and -2**63 <= (data or 0) < 2**63:
+            return [struct.pack(
+                cls._HEADER_FMT, (data or 0) % 2**64, tag, context,
+                cls._INLINE_FLAG | cls._INLINE_TYPES.index(type(data)))]
+
+        buffers = []
+
+        def buffer_callback(buffer: pickle.PickleBuffer):
+            try:
+                raw = buffer.raw()
+            except BufferError:
+                return True  # Not contiguous, serialize in-band.
+            if raw.nbytes < cls._OOB_THRESHOLD:
+                return True
+            buffers.append(raw)
+            return False
+
+        body = pickle.dumps(data, protocol=5, buffer_callback=buffer_callback)
+        try:
+            header = struct.pack(
+                f'{cls._HEADER_FMT}{len(buffers)}Q',
+                len(body), tag, context, len(buffers), *[b.nbytes for b in buffers])
+        except struct.error as e:
+            raise RuntimeError(f"Could not struct.pack({cls._HEADER_FMT!r}, {len(body)}, {tag}, {len(buffers)})") from e
+        return [header, body, *buffers]
+
+    # Ranks, that are connected with an AF_UNIX socket, send frames with at
+    # least this many bytes of payload (pickle body and out-of-band buffers)
+    # through a shared memory segment (SharedMemorySegment). Only the name
+    # of the segment is sent over the socket.
+    _SHM_THRESHOLD = 1048576  # = 2**20
+    _SHM_FLAG = 1 << 31
+    # The max total size of the shared memory segments of a rank. At most
+    # half of /dev/shm is divided between the ranks on a host.
+    _SHM_BUDGET = 268435456  # = 2**28
+
+    @classmethod
+    def to_shared_memory(cls, frame, segment: 'SharedMemorySegment', reader):
+        """
+        The frame for the receiver with the index reader of a segment, that
+        contains the payload of an encoded frame (see
+        SharedMemoryPool.create).
+
+        >>> import numpy as np
+        >>> a = np.arange(1_000_000)
+        >>> frame = Mixin.encode(3, {'a': a})
+        >>> pool = SharedMemoryPool(budget=2**24)
+        >>> segment = pool.create(frame[1:], readers=1)
+        >>> frame = Mixin.to_shared_memory(frame, segment, 0)
+        >>> len(frame)
+        1
+        >>> s1, s2 = socket.socketpair(socket.AF_UNIX)
+        >>> Mixin.sendmsg_all(s1, frame)
+        >>> data, tag = Mixin.msg_recv(s2)
+        >>> _ = s1.close(), s2.close(), pool.close()
+        >>> tag, np.array_equal(data['a'], a), data['a'].flags.writeable
+        (3, True, True)
+        """
+        header = memoryview(frame[0]).cast('B')
+        length, tag, context, nbuffers = struct.unpack_from(cls._HEADER_FMT, header)
+        lengths = struct.unpack_from(f'{nbuffers}Q', header, cls._HEADER_FMT_SIZE)
+        name = segment.name.encode()
+        return [struct.pack(
+            f'{cls._HEADER_FMT}{nbuffers}QHHB',
+            length, tag, context, nbuffers | cls._SHM_FLAG, *lengths,
+            reader, segment.readers, len(name)) + name]
+
+    @staticmethod
+    def _empty(length):
+        """
+        Memory for a received buffer. Large buffers are anonymous memory
+        maps, they are not zero filled like a bytearray, hence the pages are
+        touched only once, when the data is written.
+        """
+        if length < Mixin._OOB_THRESHOLD:
+            return bytearray(length)
+        return mmap.mmap(-1, length)
+
+    @classmethod
+    def read_frame(cls):
+        """
+        A generator, that yields the buffers, that have to be filled with
+        the next bytes of a frame. The filled buffer is sent back. Returns
+        the tag, the context, the pickle body and the out-of-band buffers.
+        For a header-only frame, the body is None and the value takes the
+        place of the buffers.
+
+        Used to receive a frame blocking (recv_frame) and piece by piece,
+        as the data arrives (PartialFrame).
+        """
+        length, tag, context, nbuffers = struct.unpack(cls._HEADER_FMT, (yield bytearray(cls._HEADER_FMT_SIZE)))
+        if nbuffers & cls._INLINE_FLAG:
+            type_ = cls._INLINE_TYPES[nbuffers & ~cls._INLINE_FLAG]
+            if type_ is type(None):
+                return tag, context, None, None
+            return tag, context, None, type_(length - 2**64 if length >= 2**63 else length)
+        in_shared_memory = bool(nbuffers & cls._SHM_FLAG)
+        nbuffers &= ~cls._SHM_FLAG
+        if nbuffers:
+            lengths = struct.unpack(f'{nbuffers}Q', (yield bytearray(struct.calcsize(f'{nbuffers}Q'))))
+        else:
+            lengths = ()
+        if in_shared_memory:
+            reader, readers, name_length = struct.unpack('=HHB', (yield bytearray(struct.calcsize('=HHB'))))
+            name = bytes((yield bytearray(name_length))).decode()
+            body, buffers = SharedMemorySegment.read(name, reader, readers, length, lengths, cls._empty)
         else:
-            data = None
-        return data, tag
+            body = yield cls._empty(length)
+            # Receive the out-of-band buffers directly into preallocated
+            # memory. Unpickling uses them without a further copy,
+            # e.g. numpy arrays are backed by these buffers.
+            buffers = []
+            for n in lengths:
+                buffers.append((yield cls._empty(n)))
+        return tag, context, body, buffers
+
+    @classmethod
+    def recv_frame(cls, sock):
+        """
+        Receive a frame, but do not unpickle it. Blocks until the frame is
+        complete. See read_frame for the return value.
+        """
+        reader = cls.read_frame()
+        buffer = next(reader)
+        try:
+            while True:
+                buffer = reader.send(cls.recv_into(sock, buffer))
+        except StopIteration as e:
+            return e.value
+
+    @staticmethod
+    def decode(body, buffers):
+        if body is None:
+            return buffers  # header-only frame, see read_frame
+        return pickle.loads(body, buffers=buffers)
+
+    @classmethod
+    def msg_recv(cls, sock):
+        tag, _, body, buffers = cls.recv_frame(sock)
+        return cls.decode(body, buffers), tag
 
     @classmethod
     def msg_send(cls, sock, tag, data):
-        if tag not in [BARRIER_TAG]:
-            b = pickle.dumps(data)
-            try:
-                msg = struct.pack(cls._HEADER_FMT, len(b), tag)
-                assert len(msg) == cls._HEADER_FMT_SIZE, (len(msg), cls._HEADER_FMT_SIZE)
-                sock.sendall(msg)
-            except struct.error as e:
-                raise RuntimeError(f"Could not sendall(struct.pack('ii', {len(b)}, {tag}))") from e
-            sock.sendall(b)
+        """
+        >>> import numpy as np, concurrent.futures
+        >>> a = np.arange(1_000_000).reshape(1000, 1000)
+        >>> with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        ...     s1, s2 = socket.socketpair(socket.AF_UNIX)
+        ...     future = executor.submit(Mixin.msg_send, s1, 3, {'a': a, 'b': 'text'})
+        ...     data, tag = Mixin.msg_recv(s2)
+        ...     _ = future.result(), s1.close(), s2.close()
+        >>> tag, data['b'], np.array_equal(data['a'], a), data['a'].flags.writeable
+        (3, 'text', True, True)
+        """
+        cls.sendmsg_all(sock, cls.encode(tag, data))
+
+
+class SharedMemorySegment:
+    """
+    A shared memory segment for the payload of a frame, that is sent to one
+    or more ranks on the same host, e.g. a broadcast writes the payload only
+    once. The sender reuses the segment for later frames, when all
+    receivers released it, see SharedMemoryPool.
+
+    A receiver copies the pickle body out, but the out-of-band buffers
+    (e.g. numpy arrays) stay in the segment, i.e., the received objects are
+    backed by the shared memory. The first bytes of the segment hold a flag
+    for each receiver, that it sets, when all its buffers are garbage
+    collected.
+
+    The segments are files in /dev/shm (i.e. the memory of the host). For
+    each receiver, the sender creates a hard link of the file, that the
+    receiver unlinks, when it opened the file. Hence, the memory is freed,
+    when the sender and all receivers closed the segment, even when the
+    sender finishes, before the receivers read the frame.
+
+    >>> segment = SharedMemorySegment.create(64 + 5)
+    >>> segment.write([b'abc', b'de'], readers=2)
+    >>> segment.released
+    False
+    >>> body, buffers = SharedMemorySegment.read(segment.name, 0, 2, 3, [2], bytearray)
+    >>> bytes(body), [bytes(b) for b in buffers]
+    (b'abc', [b'de'])
+    >>> _ = SharedMemorySegment.read(segment.name, 1, 2, 3, [2], bytearray)
+    >>> del buffers
+    >>> segment.released  # Only the buffers of the first receiver are released
+    False
+    >>> del _
+    >>> segment.released, sorted(os.listdir(segment._DIR)).count(segment.name)
+    (True, 1)
+    >>> segment.close()
+    >>> os.path.exists(os.path.join(segment._DIR, segment.name))
+    False
+    """
+    _DIR = '/dev/shm'
+
+    def __init__(self, name, mm):
+        self.name = name
+        self.size = len(mm)
+        self.readers = 0
+        # The time, when the last receiver released the segment.
+        self.idle_since = None
+        self._mm = mm
+
+    @staticmethod
+    def offset(readers):
+        # The payload starts at a multiple of 64 bytes (cache line).
+        return (readers + 63) // 64 * 64
+
+    @classmethod
+    def create(cls, size):
+        """
+        Raises an OSError, when the segment does not fit in /dev/shm.
+        """
+        name = f'dlp_mpi-{os.getpid()}-{os.urandom(8).hex()}'
+        path = os.path.join(cls._DIR, name)
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                # Allocate the pages now. Writing to a page, that does not
+                # fit in /dev/shm, would kill the process with SIGBUS.
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+        except OSError:
+            os.unlink(path)
+            raise
+        finally:
+            os.close(fd)
+        return cls(name, mm)
+
+    def write(self, buffers, readers):
+        """
+        Copy the buffers to the segment and create the links for readers
+        receivers.
+        """
+        offset = self.offset(readers)
+        self._mm[:offset] = bytes(offset)
+        for b in buffers:
+            b = memoryview(b).cast('B')
+            self._mm[offset:offset + b.nbytes] = b
+            offset += b.nbytes
+        path = os.path.join(self._DIR, self.name)
+        for reader in range(readers):
+            os.link(path, f'{path}-{reader}')
+        self.readers = readers
+        self.idle_since = None
+
+    @property
+    def released(self):
+        """
+        Whether all receivers released the segment.
+        """
+        return all(self._mm[:self.readers])
+
+    @classmethod
+    def read(cls, name, reader, readers, length, lengths, empty):
+        """
+        Receiver side: Copy the body into empty(length) and return views of
+        the segment for the buffers.
+        """
+        path = os.path.join(cls._DIR, f'{name}-{reader}')
+        fd = os.open(path, os.O_RDWR)
+        try:
+            mm = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+            os.unlink(path)
+        offset = cls.offset(readers)
+        body = empty(length)
+        memoryview(body).cast('B')[:] = mm[offset:offset + length]
+        offset += length
+
+        if not lengths:
+            mm[reader] = 1
+            mm.close()
+            return body, []
+
+        # The buffers, that back the received objects, are created from the
+        # address and hold no export of the mmap. Otherwise, closing the
+        # mmap would fail in the finalizer of the last buffer.
+        address = ctypes.addressof(ctypes.c_char.from_buffer(mm))
+        # The buffers are released by the garbage collector, i.e. maybe in
+        # another thread.
+        alive = [len(lengths)]
+        lock = threading.Lock()
+
+        def release():
+            with lock:
+                alive[0] -= 1
+                if alive[0] == 0:
+                    mm[reader] = 1
+                    mm.close()
+
+        buffers = []
+        for n in lengths:
+            # numpy keeps the ctypes object alive, as long as an array uses
+            # its memory, hence it tells when the memory is free again.
+            buffer = (ctypes.c_char * n).from_address(address + offset)
+            weakref.finalize(buffer, release).atexit = False
+            buffers.append(buffer)
+            offset += n
+        return body, buffers
+
+    def close(self):
+        """
+        Sender side: Unlink the name and unmap the segment. The receivers,
+        that have not yet read the frame, hold their links.
+        """
+        os.unlink(os.path.join(self._DIR, self.name))
+        self._mm.close()
+
+
+class SharedMemoryPool:
+    """
+    Sender side: The shared memory segments of a rank. Their total size is
+    limited by the budget, hence receivers, that keep the received arrays,
+    cannot fill the memory of the host. When the budget is exhausted,
+    create returns None and the frame is sent over the socket.
+
+    A segment is sized to the frame. When all receivers released it, it is
+    reused for a frame, that fits (at most 25 % smaller), e.g. for the
+    repeated send of arrays with the same shape, the pages are already
+    allocated. A segment, that is not reused within idle_time seconds, is
+    freed.
+
+    >>> pool = SharedMemoryPool(budget=200)
+    >>> segment = pool.create([b'x' * 50], readers=2)
+    >>> segment.size, pool.used  # 64 bytes for the flags of the receivers
+    (114, 114)
+    >>> print(pool.create([b'x' * 100], readers=1))  # Exceeds the budget
+    None
+    >>> for reader in range(2):
+    ...     _ = SharedMemorySegment.read(segment.name, reader, 2, 50, [], bytearray)
+    >>> pool.create([b'y' * 50], readers=1) is segment  # Reuse
+    True
+    >>> _ = SharedMemorySegment.read(segment.name, 0, 1, 50, [], bytearray)
+    >>> pool.idle_time = 0
+    >>> pool.collect()
+    >>> pool.used, pool.segments
+    (0, [])
+    """
+    idle_time = 1  # seconds
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.segments = []
+        if not os.path.isdir(SharedMemorySegment._DIR):
+            self.budget = 0
+
+    def create(self, buffers, readers):
+        """
+        A segment with a copy of the buffers for readers receivers or None.
+        """
+        size = SharedMemorySegment.offset(readers) + sum(memoryview(b).nbytes for b in buffers)
+        if size > self.budget:
+            return None
+        self.collect()
+        free = [s for s in self.segments if s.idle_since is not None]
+        fits = [s for s in free if size <= s.size <= size + size // 4]
+        if fits:
+            segment = min(fits, key=lambda s: s.size)
         else:
-            assert data is None, (data, tag)
-            sock.sendall(struct.pack(cls._HEADER_FMT, 0, tag))
+            # Free the unused segments, that do not fit, when the budget
+            # needs the space.
+            for s in sorted(free, key=lambda s: s.idle_since):
+                if self.used + size <= self.budget:
+                    break
+                self._free(s)
+            if self.used + size > self.budget:
+                return None
+            try:
+                segment = SharedMemorySegment.create(size)
+            except OSError as e:
+                # e.g. /dev/shm is too small (Docker uses 64 MB by default)
+                info(f"Cannot use shared memory, use the socket: {e}")
+                # Try only smaller segments again.
+                self.budget = max(self.used, size // 2)
+                return None
+            self.segments.append(segment)
+            self.used += segment.size
+        segment.write(buffers, readers)
+        return segment
+
+    def _free(self, segment):
+        segment.close()
+        self.segments.remove(segment)
+        self.used -= segment.size
+
+    def collect(self):
+        """
+        Mark the segments, that all receivers released, as unused and free
+        the segments, that are unused for idle_time seconds.
+        """
+        now = time.monotonic()
+        for segment in list(self.segments):
+            if segment.idle_since is None and segment.released:
+                segment.idle_since = now
+            if segment.idle_since is not None and now - segment.idle_since >= self.idle_time:
+                self._free(segment)
+
+    def close(self):
+        for segment in list(self.segments):
+            self._free(segment)
+
+    def __bool__(self):
+        return bool(self.segments)
+
+
+class PendingFrame:
+    """
+    The part of a frame, that is not yet sent.
+
+    The buffers of the frame are not copied, hence multiple PendingFrame
+    objects can share one encoded frame, e.g. in a broadcast each
+    destination gets its own PendingFrame.
+
+    >>> p = PendingFrame([b'ab', b'', b'cde'])
+    >>> p.advance(3)
+    >>> p.done, [b.tobytes() for b in p.iov()]
+    (False, [b'de'])
+    >>> p.advance(2)
+    >>> p.done
+    True
+    """
+    # Max number of buffers for a single sendmsg call (IOV_MAX is usually 1024).
+    _MAX_IOV = 512
+
+    def __init__(self, frame):
+        self.buffers = [memoryview(b).cast('B') for b in frame]
+        self.buffers = [b for b in self.buffers if b.nbytes]
+        self.index = 0
+
+    @property
+    def done(self):
+        return self.index == len(self.buffers)
+
+    def iov(self):
+        return self.buffers[self.index:self.index + self._MAX_IOV]
+
+    def advance(self, sent):
+        while sent:
+            if sent >= self.buffers[self.index].nbytes:
+                sent -= self.buffers[self.index].nbytes
+                self.index += 1
+            else:
+                self.buffers[self.index] = self.buffers[self.index][sent:]
+                sent = 0
+
+    def send_nonblocking(self, sock):
+        """
+        Send as much as the socket accepts without blocking.
+        Returns True, when the frame is completely sent.
+        """
+        try:
+            sent = sock.sendmsg(self.iov(), [], socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return False
+        self.advance(sent)
+        return self.done
+
+
+class PostedRecv:
+    """
+    A receive, that was posted with irecv. The first message, that matches
+    source and tag, is moved from the inbox to the posted receive, i.e. a
+    later recv cannot take it.
+    """
+    def __init__(self, source, tag, context):
+        self.source = source
+        self.tag = tag
+        self.context = context
+        self.rank = None
+        self.entry = None
+
+    @property
+    def done(self):
+        return self.entry is not None
+
+
+# Marks the socket, that interrupts the select of the progress thread.
+_WAKEUP = object()
+
+
+class PartialFrame:
+    """
+    The part of a frame, that is already received. Reads only the data,
+    that the socket has available, hence a rank is never blocked by a
+    frame, that is not yet completely sent. Otherwise, ranks, that read
+    from each other in a cycle, while their own frames wait to be written,
+    would deadlock.
+
+    >>> s1, s2 = socket.socketpair(socket.AF_UNIX)
+    >>> frame = Mixin.encode(3, 'abc')
+    >>> partial = PartialFrame()
+    >>> s1.sendall(frame[0][:10])
+    >>> print(partial.recv_nonblocking(s2))
+    None
+    >>> Mixin.sendmsg_all(s1, [frame[0][10:], *frame[1:]])
+    >>> tag, context, body, buffers = partial.recv_nonblocking(s2)
+    >>> _ = s1.close(), s2.close()
+    >>> tag, Mixin.decode(body, buffers)
+    (3, 'abc')
+    """
+    def __init__(self):
+        self._reader = Mixin.read_frame()
+        self._next(next(self._reader))
+
+    def _next(self, buffer):
+        self._buffer = buffer
+        self._view = memoryview(buffer).cast('B')
+        self._read = 0
+
+    def recv_nonblocking(self, sock):
+        """
+        Read as much as the socket has available.
+        Returns the frame (see Mixin.read_frame), when it is complete.
+        """
+        while True:
+            remaining = self._view.nbytes - self._read
+            if remaining == 0:
+                try:
+                    self._next(self._reader.send(self._buffer))
+                except StopIteration as e:
+                    return e.value
+                continue
+            try:
+                received = sock.recv_into(
+                    self._view[self._read:], min(remaining, Mixin._MAX_RECV), socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return None
+            if received == 0:
+                raise SocketClosed("Socket closed")
+            self._read += received
+
+
+class PendingHandshake:
+    """
+    A direct connection, that is accepted, but whose rank and token are not
+    yet received. The bytes are read as they arrive, hence a connection,
+    that sends nothing (e.g. a port scanner), cannot block the rank. It is
+    dropped, when the rank makes progress after the timeout.
+
+    >>> s1, s2 = socket.socketpair(socket.AF_UNIX)
+    >>> handshake = PendingHandshake(s2, 4)
+    >>> print(handshake.recv_nonblocking())
+    None
+    >>> s1.sendall(b'ab')
+    >>> print(handshake.recv_nonblocking())
+    None
+    >>> s1.sendall(b'cd')
+    >>> handshake.recv_nonblocking()
+    b'abcd'
+    >>> _ = s1.close(), s2.close()
+    """
+    _TIMEOUT = 10  # seconds
+
+    def __init__(self, sock, length):
+        self.sock = sock
+        self.deadline = time.monotonic() + self._TIMEOUT
+        self._buffer = bytearray(length)
+        self._read = 0
+
+    @property
+    def expired(self):
+        return time.monotonic() > self.deadline
+
+    def recv_nonblocking(self):
+        """
+        Read as much as the socket has available.
+        Returns the bytes, when they are complete.
+        """
+        try:
+            received = self.sock.recv_into(
+                memoryview(self._buffer)[self._read:], 0, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return None
+        if received == 0:
+            raise SocketClosed("Socket closed")
+        self._read += received
+        if self._read == len(self._buffer):
+            return bytes(self._buffer)
+        return None
+
+
+def _new_peer(rank, sock=None, addr=None):
+    """
+    The state of the connection to another rank.
+
+    sock is the socket that is used to send to that rank. A peer may have
+    more than one socket, when both ranks opened a direct connection at the
+    same time. Each direction always uses the same socket, hence the
+    messages between two ranks keep their order.
+
+    inbox maps the context of a communicator to the received messages, i.e.
+    (arrival, tag, pickle body, out-of-band buffers).
+    """
+    return types.SimpleNamespace(
+        addr=addr, rank=rank, sock=sock, nsocks=0 if sock is None else 1,
+        closed=False, inbox=collections.defaultdict(collections.deque), outbox=collections.deque())
 
 
-class Rootv3(Mixin):
-    def __init__(self, sel, socks, host, port, rank, size, debug=False):
+def _rank_fmt(size):
+    if size < 200:
+        return 'B'  # limited to 256 processes
+    else:
+        return 'H'  # limited to 65536 processes
+
+
+_MESH_TOKEN_LENGTH = 16
+
+
+class Nodev3(Mixin):
+    """
+    A rank, that is connected to other ranks.
+
+    The selector watches each connection for incoming data, but only for
+    writability, while there is a pending outbound frame for that peer.
+    TCP sockets are nearly always writable, hence watching them all the
+    time would let `select` return immediately, i.e. an idle root would
+    busy-spin.
+
+    Messages, that arrive while the rank waits for something else, are
+    stored in an inbox per peer and communicator and returned by a later
+    `recv`.
+
+    Direct connections between two ranks (mesh) are opened lazily on the
+    first send. The root collects the addresses of the listening sockets and
+    the hostnames of all ranks and distributes them, when the connections to
+    the root are established. Ranks on the same host connect with AF_UNIX
+    sockets. Over AF_UNIX sockets, large frames are sent through shared
+    memory. The hostname alone is not enough, e.g. two containers may have
+    the same hostname, but different /dev/shm.
+
+    >>> import resource
+    >>> from dlp_mpi.ame.testing import thread_based_test
+    >>> def idle(host, port, rank, size, authkey):
+    ...     con = establish_connection_v3(host, port, rank, size, authkey=authkey)
+    ...     if rank == 0:
+    ...         start = resource.getrusage(resource.RUSAGE_THREAD)
+    ...         data = con.recv()
+    ...         end = resource.getrusage(resource.RUSAGE_THREAD)
+    ...         cpu_time = (end.ru_utime - start.ru_utime) + (end.ru_stime - start.ru_stime)
+    ...         return data, cpu_time
+    ...     else:
+    ...         time.sleep(1)
+    ...         con.send('hello', 0)
+    >>> data, cpu_time = thread_based_test(idle, 2)[0]
+    Wait for thread 1
+    Thread 1 finished
+    >>> data, cpu_time < 0.1  # Waiting 1 second without burning the CPU
+    ('hello', True)
+
+    Two workers exchange messages without the root:
+    >>> def exchange(host, port, rank, size, authkey):
+    ...     con = establish_connection_v3(host, port, rank, size, authkey=authkey)
+    ...     if rank != 0:
+    ...         other = 3 - rank
+    ...         con.send(f'hello from {rank}', other)
+    ...         return con.recv(other), sorted(con.peers)
+    >>> out = thread_based_test(exchange, 3)
+    Wait for thread 1
+    Thread 1 finished
+    Wait for thread 2
+    Thread 2 finished
+    >>> out[1], out[2]
+    (('hello from 2', [0, 2]), ('hello from 1', [0, 1]))
+
+    Ranks on the same host send large arrays through shared memory:
+    >>> import numpy as np
+    >>> def large(host, port, rank, size, authkey):
+    ...     con = establish_connection_v3(host, port, rank, size, authkey=authkey)
+    ...     if rank == 0:
+    ...         return con.recv(1)
+    ...     con.send(np.arange(1_000_000), 0)
+    >>> segments = set(os.listdir('/dev/shm'))
+    >>> np.array_equal(thread_based_test(large, 2)[0], np.arange(1_000_000))
+    Wait for thread 1
+    Thread 1 finished
+    True
+    >>> set(os.listdir('/dev/shm')) - segments  # The ranks closed the segment
+    set()
+
+    When all ranks are on one host, all connections are AF_UNIX sockets:
+    >>> def families(host, port, rank, size, authkey):
+    ...     con = establish_connection_v3(host, port, rank, size, authkey=authkey)
+    ...     if rank != 0:
+    ...         con.send(rank, 3 - rank)
+    ...         con.recv(3 - rank)
+    ...     return sorted({peer.sock.family.name for peer in con.peers.values()})
+    >>> out = thread_based_test(families, 3)
+    Wait for thread 1
+    Thread 1 finished
+    Wait for thread 2
+    Thread 2 finished
+    >>> out[0], out[1], out[2]
+    (['AF_UNIX'], ['AF_UNIX'], ['AF_UNIX'])
+
+    A connection to the mesh listener, that sends nothing, does not block:
+    >>> def silent(host, port, rank, size, authkey):
+    ...     con = establish_connection_v3(host, port, rank, size, authkey=authkey)
+    ...     if rank == 1:
+    ...         with socket.create_connection(con.mesh[2][0]):
+    ...             con.send('hello', 2)
+    ...             return con.recv(2)
+    ...     elif rank == 2:
+    ...         con.send(con.recv(1), 1)
+    >>> out = thread_based_test(silent, 3)
+    Wait for thread 1
+    Thread 1 finished
+    Wait for thread 2
+    Thread 2 finished
+    >>> out[1]
+    'hello'
+    """
+    def __init__(self, sel, host, port, rank, size, debug=False, *, mesh, token, hosts, runtime_dir=None):
         super().__init__(host, port, rank, size, debug)
         self.sel = sel
-        self.socks = socks
+        self.peers = {
+            key.data.rank: key.data
+            for key in sel.get_map().values()
+            if key.data is not None
+        }
+        # rank -> (address, path, token) of the listening sockets of the
+        # other ranks, i.e. TCP and AF_UNIX. The token authenticates a
+        # direct connection.
+        self.mesh = mesh
+        if runtime_dir is not None:
+            # Contains the AF_UNIX socket of this rank.
+            weakref.finalize(self, shutil.rmtree, runtime_dir, ignore_errors=True)
+        self._token = token
+        # The hostname of each rank. Ranks on the same host try to connect
+        # with AF_UNIX sockets.
+        self.hosts = hosts
+        self._fmt = _rank_fmt(size)
+        # Counter for the received messages. Used to return the oldest
+        # message, when the source is ANY_SOURCE.
+        self._arrival = itertools.count()
+        # socket -> PartialFrame, the frames that are not yet complete.
+        self._partial = {}
+        # The accepted direct connections, that have not yet sent their
+        # rank and token.
+        self._handshakes = set()
+        # The shared memory segments of the large frames to ranks on the
+        # same host.
+        self._shm = SharedMemoryPool(self._shm_budget())
+        # The smallest context, that is not used by a communicator on this
+        # rank. Context 0 is COMM_WORLD.
+        self.next_context = 1
+
+        # Non-blocking communication (isend, irecv): A thread makes
+        # progress, while the caller computes. The thread is started by
+        # isend/irecv and pauses, while the caller communicates.
+        self._posted = []
+        self._lock = threading.RLock()
+        self._resume = threading.Condition(self._lock)
+        self._thread = None
+        self._waiting = 0  # Number of callers, that wait for the lock
+        self._wakeup = None  # socketpair to interrupt the select
+        self._progress_error = None
+        # context -> handler of the WIN_TAG requests of other ranks, i.e.
+        # the windows with memory on this rank.
+        self._windows = {}
+        # The ranks, whose connections are closed, in the order of the
+        # detection. A rank, that finished, is also lost.
+        self.lost = []
 
     def __del__(self):
+        if self.sel is None:
+            return  # Already closed
+        for key in list(self.sel.get_map().values()):
+            key.fileobj.close()
         self.sel.close()
-
-    def send(self, data, dest, tag=ANY_TAG):
+        self.sel = None
+        if self._wakeup is not None:
+            self._wakeup[1].close()
+        self._shm.close()
+
+    def _add_socket(self, rank, sock):
+        peer = self.peers.get(rank)
+        if peer is None:
+            peer = self.peers[rank] = _new_peer(rank)
+        if peer.sock is None:
+            peer.sock = sock
+        peer.nsocks += 1
+        self.sel.register(sock, selectors.EVENT_READ, peer)
+        return peer
+
+    def _connect(self, rank):
+        """
+        Open a direct connection to another rank.
+        """
+        address, path, token = self.mesh[rank]
+        sock = None
+        if path is not None and self.hosts[rank] == self.hosts[self.rank]:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+            except OSError:
+                # e.g. the same hostname, but another container
+                sock.close()
+                if address is None:
+                    raise
+                sock = None
+        if sock is None:
+            sock = socket.create_connection(address)
+        if self.debug:
+            sock = _Socket(sock)
+        # No challenge response: The other rank may be busy and the
+        # connect must not wait for it. The token was distributed over the
+        # authenticated connections to the root.
+        sock.sendall(struct.pack(self._fmt, self.rank) + token)
+        return self._add_socket(rank, sock)
+
+    def _accept(self, listener):
+        """
+        Accept a direct connection. The rank and the token are read by
+        _handshake, when they arrive.
+        """
+        sock, _ = listener.accept()
+        handshake = PendingHandshake(sock, struct.calcsize(self._fmt) + _MESH_TOKEN_LENGTH)
+        self._handshakes.add(handshake)
+        self.sel.register(sock, selectors.EVENT_READ, handshake)
+        # Usually, the rank and the token are already there.
+        self._handshake(handshake)
+
+    def _handshake(self, handshake):
+        """
+        Read the rank and the token of an accepted connection. Connections,
+        that close, send a wrong token or do not complete the handshake in
+        time, are dropped.
+        """
+        try:
+            data = handshake.recv_nonblocking()
+        except (SocketClosed, ConnectionError):
+            data = b''
+        if data is None and not handshake.expired:
+            return
+        self._handshakes.discard(handshake)
+        self.sel.unregister(handshake.sock)
+        sock = handshake.sock
+        rank_length = struct.calcsize(self._fmt)
+        rank = struct.unpack(self._fmt, data[:rank_length])[0] if data else None
+        if rank is None or rank in [self.rank, 0] or rank >= self.size or not hmac.compare_digest(
+                data[rank_length:], self._token):
+            # Not a rank of this job, ignore the connection.
+            sock.close()
+            return
+        if self.debug:
+            sock = _Socket(sock)
+        self._add_socket(rank, sock)
+
+    def _enqueue(self, rank, frame):
+        peer = self.peers.get(rank)
+        if peer is None:
+            peer = self._connect(rank)
+        pending = PendingFrame(frame)
+        if not peer.outbox:
+            self.sel.modify(peer.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, peer)
+        peer.outbox.append(pending)
+        return pending
+
+    def _shm_budget(self):
+        local = self.hosts.count(self.hosts[self.rank])
+        if local == 1:
+            return 0
+        try:
+            stat = os.statvfs(SharedMemorySegment._DIR)
+        except OSError:
+            return 0
+        return min(self._SHM_BUDGET, stat.f_frsize * stat.f_blocks // 2 // local)
+
+    def _enqueue_all(self, ranks, frame):
+        """
+        Enqueue the frame for each rank. The payload of a large frame is
+        written once to a shared memory segment, that all ranks read, that
+        are connected with an AF_UNIX socket. The hostname alone is not
+        enough, e.g. two containers may have the same hostname, but
+        different /dev/shm.
+        """
+        frames = dict.fromkeys(ranks, frame)
+        if len(frame) > 2 or len(frame[-1]) >= self._SHM_THRESHOLD:
+            # Most frames are small and have no out-of-band buffers.
+            if sum(memoryview(b).nbytes for b in frame[1:]) >= self._SHM_THRESHOLD:
+                for rank in ranks:
+                    if rank not in self.peers:
+                        self._connect(rank)
+                local = [rank for rank in ranks if self.peers[rank].sock.family == socket.AF_UNIX]
+                segment = self._shm.create(frame[1:], len(local)) if local else None
+                if segment is not None:
+                    for reader, rank in enumerate(local):
+                        frames[rank] = self.to_shared_memory(frame, segment, reader)
+        return [self._enqueue(rank, frames[rank]) for rank in ranks]
+
+    def _close(self, key):
+        # Keep the peer, its inbox may contain messages that are not yet
+        # received.
+        self._partial.pop(key.fileobj, None)
+        self.sel.unregister(key.fileobj)
+        key.fileobj.close()
+        key.data.nsocks -= 1
+        key.data.closed = True
+        if key.data.nsocks == 0 and key.data.rank not in self.lost:
+            self.lost.append(key.data.rank)
+
+    def _progress(self, timeout=None):
+        """
+        Wait for events and handle them, i.e. read incoming messages into
+        the inboxes, write pending frames and accept direct connections.
+        Returns the number of events.
+
+        The messages are stored as received, i.e. they are unpickled by
+        recv. Hence, probe can report the size without unpickling.
+        """
+        events = self.sel.select(timeout=timeout)
+        # New connections first: A rank, that sent a message over a new
+        # direct connection and finished, would otherwise look lost, when
+        # the close of its other connection is handled first.
+        events.sort(key=lambda event: not (event[0].data is None or isinstance(event[0].data, PendingHandshake)))
+        for handshake in [h for h in self._handshakes if h.expired]:
+            self._handshake(handshake)
+        if self._shm:
+            self._shm.collect()
+        for key, mask in events:
+            if key.data is None:
+                self._accept(key.fileobj)
+                continue
+            if isinstance(key.data, PendingHandshake):
+                if key.data in self._handshakes:
+                    self._handshake(key.data)
+                continue
+            if key.data is _WAKEUP:
+                try:
+                    key.fileobj.recv(4096)
+                except BlockingIOError:
+                    pass
+                continue
+            if mask & selectors.EVENT_READ:
+                try:
+                    partial = self._partial.get(key.fileobj)
+                    if partial is None:
+                        partial = self._partial[key.fileobj] = PartialFrame()
+                    frame = partial.recv_nonblocking(key.fileobj)
+                    if frame is not None:
+                        del self._partial[key.fileobj]
+                        msg_tag, context, body, buffers = frame
+                        if msg_tag == WIN_TAG:
+                            # Answer immediately, the caller of this rank
+                            # does not know about the request.
+                            reply = self._windows[context](self.decode(body, buffers))
+                            self._enqueue(key.data.rank, self.encode(WIN_REPLY_TAG, reply, context))
+                        else:
+                            key.data.inbox[context].append((next(self._arrival), msg_tag, body, buffers))
+                            if self._posted:
+                                self._claim()
+                except (SocketClosed, ConnectionError):
+                    # The other side closed the socket.
+                    # That can happen, when the source is ANY_SOURCE,
+                    # i.e. one RANK has finished, while others are still running.
+                    # A killed process may reset the connection.
+                    self._close(key)
+                    continue
+            if mask & selectors.EVENT_WRITE:
+                outbox = key.data.outbox
+                try:
+                    while outbox and outbox[0].send_nonblocking(key.fileobj):
+                        outbox.popleft()
+                except ConnectionError:
+                    self._close(key)
+                    continue
+                if not outbox:
+                    self.sel.modify(key.fileobj, selectors.EVENT_READ, key.data)
+        return len(events)
+
+    def _is_closed(self, rank):
+        return rank in self.peers and self.peers[rank].closed
+
+    def _match(self, source, tag, context):
+        """
+        Find the oldest message from source with tag in the inboxes.
+        Returns the rank and the index in its inbox or None.
+
+        ANY_TAG matches only the tags of point-to-point messages (>= 0),
+        i.e. not the internal tags of the collectives.
+        """
+        if source == ANY_SOURCE:
+            ranks = self.peers
+        else:
+            ranks = [source] if source in self.peers else []
+        oldest = None
+        for rank in ranks:
+            for index, (arrival, msg_tag, _, _) in enumerate(self.peers[rank].inbox.get(context, ())):
+                if msg_tag == tag or (tag == ANY_TAG and msg_tag >= 0):
+                    if oldest is None or arrival < oldest[0]:
+                        oldest = (arrival, rank, index)
+                    break
+        return None if oldest is None else oldest[1:]
+
+    def _check_closed(self, source):
+        """
+        Raise SocketClosed, when no message from source can arrive anymore.
+        """
+        if source == ANY_SOURCE:
+            if all(peer.nsocks == 0 for peer in self.peers.values()):
+                raise SocketClosed("Cannot receive from ANY_SOURCE. All connections are closed.")
+        elif self._is_closed(source) and self.peers[source].nsocks == 0:
+            raise SocketClosed(f"Cannot receive from rank {source}. The connection is closed.")
+
+    @staticmethod
+    def _set_status(status, rank, entry):
+        if status is not None:
+            _, status.tag, body, buffers = entry
+            status.source = rank
+            status.count = 0 if body is None else (
+                len(body) + sum(memoryview(b).nbytes for b in buffers))
+
+    def send(self, data, dest, tag=0, context=0):
         if isinstance(dest, int):
             dest = {dest}
         elif isinstance(dest, (tuple, list, set)):
@@ -115,24 +1182,62 @@ class Rootv3(Mixin):
         else:
             raise TypeError(dest, type(dest))
 
-        while dest:
-            events = self.sel.select(timeout=None)
-            for key, mask in events:
-                if key.data is None:
-                    raise Exception('Got unexpected connection', key, mask)
-                else:
-                    if mask & selectors.EVENT_READ:
-                        pass
-                    if mask & selectors.EVENT_WRITE:
-                        if key.data.rank in dest:
-                            dest.remove(key.data.rank)
-                            self.msg_send(key.fileobj, tag, data)
-                if not dest:
-                    break
+        for rank in dest:
+            assert 0 <= rank < self.size and rank != self.rank, (rank, self.rank, self.size)
+
+        # Serialize only once, also for a broadcast. The frame is then
+        # written to the sockets as they become writable. Partial writes are
+        # interleaved, so a slow receiver does not delay the others.
+        frame = self.encode(tag, data, context)
+
+        with self._locked():
+            for rank in dest:
+                if self._is_closed(rank):
+                    raise SocketClosed(f"Cannot send to rank {rank}. The connection is closed.")
+            pending = self._enqueue_all(dest, frame)
+
+            while not all(p.done for p in pending):
+                self._progress()
+                for rank, p in zip(dest, pending):
+                    if not p.done and self._is_closed(rank):
+                        raise SocketClosed(f"Cannot send to rank {rank}. The connection is closed.")
+
+    def probe(self, source=ANY_SOURCE, tag=ANY_TAG, status=None, context=0, block=True, interrupt=None):
+        """
+        Wait for a message from source with tag, but do not receive it.
+        The status gets the source, the tag and the size in bytes (count)
+        of the message. The message is not unpickled.
+
+        With block=False, return immediately whether such a message is
+        available (iprobe).
+
+        interrupt: Raise ProcFailed, when no message is available and
+            interrupt() is true, i.e. the caller waits for a lost rank.
+        """
+        with self._locked():
+            match = self._match(source, tag, context)
+            while match is None:
+                if interrupt is not None and interrupt():
+                    raise ProcFailed(f"Rank {self.rank} waits for a lost rank.")
+                if block:
+                    self._check_closed(source)
+                    self._progress()
+                elif not self._progress(timeout=0):
+                    # Nothing more has arrived.
+                    return False
+                match = self._match(source, tag, context)
+            rank, index = match
+            self._set_status(status, rank, self.peers[rank].inbox[context][index])
+            return True
 
-    def recv(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
-        assert tag == ANY_TAG, (tag, f'Only ANY_TAG ({ANY_SOURCE}) is supported. Not {tag}')
+    def recv(self, source=ANY_SOURCE, tag=ANY_TAG, status=None, context=0, interrupt=None):
+        """
+        Receive the oldest message from source with tag. Messages with
+        other tags stay in the inbox for a later recv.
 
+        source may be a list of ranks (gather), then a dict from the rank
+        to the message is returned. For interrupt see probe.
+        """
         if isinstance(source, int):
             pass
         elif isinstance(source, (tuple, list, set)):
@@ -143,56 +1248,206 @@ class Rootv3(Mixin):
         else:
             raise TypeError(source, type(source))
 
-        datas = {}
-        while isinstance(source, int) or source:
-            events = self.sel.select(timeout=None)
-            for key, mask in events:
-                if key.data is None:
-                    raise Exception('Got unexpected connection', key, mask)
+        with self._locked():
+            datas = {}
+            while True:
+                if isinstance(source, int):
+                    match = self._match(source, tag, context)
+                    if match is not None:
+                        rank, index = match
+                        inbox = self.peers[rank].inbox[context]
+                        entry = inbox[index]
+                        del inbox[index]
+                        self._set_status(status, rank, entry)
+                        return self.decode(*entry[2:])
+                    if interrupt is not None and interrupt():
+                        raise ProcFailed(f"Rank {self.rank} waits for a lost rank.")
+                    self._check_closed(source)
                 else:
-                    if mask & selectors.EVENT_READ:
-                        if ANY_SOURCE == source or key.data.rank == source or key.data.rank in source:
-                            try:
-                                data, msg_tag = self.msg_recv(key.fileobj)
-                            except SocketClosed:
-                                if source != ANY_SOURCE:
-                                    raise
-                                # The other side closed the socket.from
-                                # That can happen, when the source is ANY_SOURCE,
-                                # i.e. one RANK has finished, while others are still running.
-                                self.sel.unregister(key.fileobj)
-                                key.fileobj.close()
-                                del self.socks[key.data.addr]
-                                assert len(self.socks) > 0, self.socks
-                                continue
-
-                            if ANY_SOURCE == source or key.data.rank == source:
-                                if status:
-                                    status.source = key.data.rank
-                                    status.tag = msg_tag
-                                return data
-                            else:
-                                source.remove(key.data.rank)
-                                datas[key.data.rank] = data
-                    if mask & selectors.EVENT_WRITE:
-                        pass
-                if isinstance(source, set) and len(source) == 0:
-                    break
-        return datas
+                    for rank in list(source):
+                        match = self._match(rank, tag, context)
+                        if match is not None:
+                            inbox = self.peers[rank].inbox[context]
+                            entry = inbox[match[1]]
+                            del inbox[match[1]]
+                            datas[rank] = self.decode(*entry[2:])
+                            source.remove(rank)
+                        else:
+                            self._check_closed(rank)
+                    if len(source) == 0:
+                        return datas
+                self._progress()
+
+    _UNLOCKED = contextlib.nullcontext()
+
+    def _locked(self):
+        """
+        Exclusive access to the connections. A running progress thread is
+        interrupted and waits, until the caller is done.
+        """
+        if self._progress_error is not None:
+            raise self._progress_error
+        if self._thread is None:
+            # Only the caller uses the connections, e.g. no isend/irecv
+            # was used recently.
+            return self._UNLOCKED
+        return self._pause_progress()
+
+    @contextlib.contextmanager
+    def _pause_progress(self):
+        self._waiting += 1
+        try:
+            self._wakeup[1].send(b'\0')
+        except BlockingIOError:
+            pass  # The thread is already interrupted.
+        with self._lock:
+            self._waiting -= 1
+            try:
+                yield
+            finally:
+                self._resume.notify()
 
+    # The progress thread stops, when it had nothing to do for this time,
+    # and is started again by the next isend/irecv.
+    _PROGRESS_IDLE_TIMEOUT = 1
 
-class Clientv3(Mixin):
-    def __init__(self, sock, host, port, rank, size, debug=False):
-        super().__init__(host, port, rank, size, debug)
-        self.sock = sock
+    def _has_work(self):
+        return bool(self._posted) or bool(self._windows) or any(
+            peer.outbox and not peer.closed for peer in self.peers.values())
+
+    def _progress_loop(self):
+        with self._lock:
+            try:
+                while True:
+                    if self._waiting or not self._has_work():
+                        if not self._resume.wait(self._PROGRESS_IDLE_TIMEOUT):
+                            if not self._waiting and not self._has_work():
+                                break
+                        continue
+                    self._progress()
+            except Exception as e:
+                # Raised in the caller by the next communication.
+                self._progress_error = e
+            finally:
+                self._thread = None
+
+    def _start_progress(self):
+        # The lock is necessary, when the caller did not pause a thread.
+        with self._lock:
+            if self._wakeup is None:
+                self._wakeup = socket.socketpair()
+                for sock in self._wakeup:
+                    sock.setblocking(False)
+                self.sel.register(self._wakeup[0], selectors.EVENT_READ, _WAKEUP)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._progress_loop, name=f'dlp_mpi progress {self.rank}', daemon=True)
+                self._thread.start()
+
+    def _claim(self):
+        """
+        Move the first matching message in the inboxes to each posted
+        receive, in the order the receives were posted.
+        """
+        for posted in list(self._posted):
+            match = self._match(posted.source, posted.tag, posted.context)
+            if match is not None:
+                posted.rank, index = match
+                inbox = self.peers[posted.rank].inbox[posted.context]
+                posted.entry = inbox[index]
+                del inbox[index]
+                self._posted.remove(posted)
+
+    def isend(self, data, dest, tag=0, context=0):
+        """
+        Start to send data to dest and return a PendingFrame, that is done,
+        when the frame is written to the socket. The progress thread writes
+        it, while the caller does something else.
+        """
+        assert isinstance(dest, int) and 0 <= dest < self.size and dest != self.rank, (dest, self.rank, self.size)
+        frame = self.encode(tag, data, context)
+        with self._locked():
+            if self._is_closed(dest):
+                raise SocketClosed(f"Cannot send to rank {dest}. The connection is closed.")
+            pending, = self._enqueue_all([dest], frame)
+            pending.rank = dest
+            self._start_progress()
+        return pending
+
+    def irecv(self, source=ANY_SOURCE, tag=ANY_TAG, context=0):
+        """
+        Post a receive and return it as PostedRecv. The progress thread
+        reads the incoming messages, while the caller does something else.
+        """
+        posted = PostedRecv(source, tag, context)
+        with self._locked():
+            self._posted.append(posted)
+            self._claim()
+            if not posted.done:
+                self._start_progress()
+        return posted
+
+    def wait(self, requests, block=True, wait_any=False):
+        """
+        Make progress until all (or with wait_any, one) of the requests
+        (PendingFrame or PostedRecv) are done. Returns whether they are
+        done. With block=False, handle only what has already arrived.
+        """
+        check = any if wait_any else all
+        with self._locked():
+            while not check(r.done for r in requests):
+                if not block:
+                    if not self._progress(timeout=0):
+                        return False
+                    continue
+                for r in requests:
+                    if r.done:
+                        pass
+                    elif isinstance(r, PostedRecv):
+                        self._check_closed(r.source)
+                    elif self._is_closed(r.rank):
+                        raise SocketClosed(f"Cannot send to rank {r.rank}. The connection is closed.")
+                self._progress()
+            return True
+
+    def expose(self, context, handler):
+        """
+        Answer the WIN_TAG requests on the context with handler(request).
+        The progress thread runs, until the window is hidden, hence the
+        requests are served, while the caller computes.
+        """
+        with self._locked():
+            self._windows[context] = handler
+            self._start_progress()
+
+    def hide(self, context):
+        with self._locked():
+            del self._windows[context]
+
+    def complete(self, request, status=None):
+        """
+        The data of a done PostedRecv. None for a PendingFrame.
+        """
+        if isinstance(request, PostedRecv):
+            self._set_status(status, request.rank, request.entry)
+            return self.decode(*request.entry[2:])
+        return None
+
+
+class Rootv3(Nodev3):
+    """
+    The root is connected to all other ranks.
+    """
 
-    def __del__(self):
-        self.sock.close()
 
-    def send(self, obj, dest, tag=ANY_TAG):
-        assert dest == 0, dest
+class Clientv3(Nodev3):
+    """
+    A worker is connected to the root and opens direct connections to other
+    workers on demand.
+    """
+    def send(self, obj, dest, tag=0, context=0):
         try:
-            return self.msg_send(self.sock, tag, obj)
+            return super().send(obj, dest, tag, context)
         except SocketClosed:
             if DEBUG:
                 raise SocketClosed(
@@ -204,12 +1459,9 @@ class Clientv3(Mixin):
                 info(f"Issue in send for RANK {self.rank}. Set DLP_MPI_DEBUG to get a traceback.")
                 sys.exit(1)
 
-    def recv(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
-        assert tag == ANY_TAG, (tag, f'Only ANY_TAG ({ANY_SOURCE}) is supported. Not {tag}')
-        assert source in [0, ANY_SOURCE], source
-
+    def recv(self, source=ANY_SOURCE, tag=ANY_TAG, status=None, context=0, interrupt=None):
         try:
-            data, msg_tag = self.msg_recv(self.sock)
+            return super().recv(source, tag, status, context, interrupt)
         except SocketClosed:
             if DEBUG:
                 raise SocketClosed(
@@ -220,11 +1472,28 @@ class Clientv3(Mixin):
                 # problem, hence print only one line instead of a fill traceback.
                 info(f"Issue in recv for RANK {self.rank}. Set DLP_MPI_DEBUG to get a traceback.")
                 sys.exit(1)
-        if status:
-            status.source = 0
-            status.tag = msg_tag
 
-        return data
+    def probe(self, source=ANY_SOURCE, tag=ANY_TAG, status=None, context=0, block=True, interrupt=None):
+        try:
+            return super().probe(source, tag, status, context, block, interrupt)
+        except SocketClosed:
+            if DEBUG:
+                raise SocketClosed(
+                    f"Could not probe on {self.rank} from {source} with tag {tag}") from None
+            else:
+                info(f"Issue in probe for RANK {self.rank}. Set DLP_MPI_DEBUG to get a traceback.")
+                sys.exit(1)
+
+    def wait(self, requests, block=True, wait_any=False):
+        try:
+            return super().wait(requests, block, wait_any)
+        except SocketClosed:
+            if DEBUG:
+                raise SocketClosed(
+                    f"Could not wait on {self.rank} for {requests}") from None
+            else:
+                info(f"Issue in wait for RANK {self.rank}. Set DLP_MPI_DEBUG to get a traceback.")
+                sys.exit(1)
 
 
 class _Socket:
@@ -241,6 +1510,11 @@ class _Socket:
         info(f"sendall {bytes} (len: {len(bytes)})", frames=2)
         return self.s.sendall(bytes)
 
+    def sendmsg(self, buffers, *args):
+        r = self.s.sendmsg(buffers, *args)
+        info(f"sendmsg {len(buffers)} buffers (sent: {r})", frames=2)
+        return r
+
     def recv(self, *args):
         r = self.s.recv(*args)
         info(f"recv {r}", frames=2)
@@ -249,20 +1523,112 @@ class _Socket:
     def fileno(self):
         return self.s.fileno()
 
+    @property
+    def family(self):
+        return self.s.family
+
+    def getsockname(self):
+        return self.s.getsockname()
+
     def close(self):
         return self.s.close()
 
-    def recv_into(self, buffer: memoryview, nbytes=None):
-        r = self.s.recv_into(buffer=buffer, nbytes=nbytes)
+    def recv_into(self, buffer: memoryview, nbytes=0, flags=0):
+        r = self.s.recv_into(buffer, nbytes, flags)
         info(f"{r} = recv_into {buffer.tobytes()[:r]} {nbytes}", frames=2)
         return r
 
 
+def _runtime_dir():
+    """
+    A new directory for the AF_UNIX sockets of a rank, in $XDG_RUNTIME_DIR
+    or the temporary directory. Only the user can access it.
+    """
+    return tempfile.mkdtemp(prefix='dlp_mpi-', dir=os.environ.get('XDG_RUNTIME_DIR'))
+
+
+def _mesh_listener(sock):
+    """
+    Open the listening sockets for direct connections from other ranks and
+    announce them and the hostname to the root.
+
+    Ranks on the same host connect to the AF_UNIX socket. The TCP socket
+    binds to the interface, that is used to reach the root.
+    """
+    listeners = []
+    runtime_dir = path = None
+    try:
+        runtime_dir = _runtime_dir()
+        path = os.path.join(runtime_dir, 'mesh.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen()
+        listeners.append(listener)
+    except OSError as e:
+        info(f"Cannot listen on an AF_UNIX socket, use TCP: {e}")
+        if runtime_dir is not None:
+            shutil.rmtree(runtime_dir, ignore_errors=True)
+        runtime_dir = path = None
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind((sock.getsockname()[0], 0))
+    listener.listen()
+    listeners.append(listener)
+    token = os.urandom(_MESH_TOKEN_LENGTH)
+    Mixin.msg_send(sock, 0, (listener.getsockname(), path, token, socket.gethostname()))
+    return listeners, token, runtime_dir
+
+
+def _reconnect(sock, path, hello, debug):
+    """
+    Worker side: Replace the connection to the root with an AF_UNIX
+    connection. The root gets over the old connection, whether that worked.
+    """
+    new = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        new.connect(path)
+        new.sendall(hello)
+    except OSError as e:
+        # e.g. the same hostname, but another container
+        info(f"Cannot connect to {path}, keep TCP: {e}")
+        new.close()
+        Mixin.msg_send(sock, 0, False)
+        return sock
+    Mixin.msg_send(sock, 0, True)
+    sock.close()
+    return _Socket(new) if debug else new
+
+
+def _accept_reconnects(sel, connected, listener, token, fmt, debug):
+    """
+    Root side of _reconnect.
+    """
+    pending = {rank for rank, sock in connected.items() if Mixin.msg_recv(sock)[0]}
+    while pending:
+        conn, _ = listener.accept()
+        try:
+            rank, = struct.unpack(fmt, Mixin.recv_nbytes(conn, struct.calcsize(fmt)))
+            valid = rank in pending and hmac.compare_digest(Mixin.recv_nbytes(conn, _MESH_TOKEN_LENGTH), token)
+        except SocketClosed:
+            valid = False
+        if not valid:
+            conn.close()
+            continue
+        pending.remove(rank)
+        if debug:
+            conn = _Socket(conn)
+        peer = sel.get_key(connected[rank]).data
+        sel.unregister(connected[rank])
+        connected[rank].close()
+        peer.sock = conn
+        sel.register(conn, selectors.EVENT_READ, peer)
+
+
 def establish_connection_v3(host, port, rank, size, *, authkey, debug=False) -> 'Rootv3|Clientv3':
-    if size < 200:
-        fmt = 'B'  # limited to 256 processes
-    else:
-        fmt = 'H'  # limited to 65536 processes
+    """
+    The workers connect to the root with TCP, i.e. host and port. When all
+    ranks are on one host, the workers reconnect with an AF_UNIX socket.
+    """
+    fmt = _rank_fmt(size)
     fmt_len = struct.calcsize(fmt)
 
     try:
@@ -287,33 +1653,63 @@ def establish_connection_v3(host, port, rank, size, *, authkey, debug=False) ->
         try:
             # ToDo: Remove connected dict. It is not nessesary.
             connected = {}
+            mesh = {}
+            hosts = [socket.gethostname()] * size
             while True:
                 events = sel.select(timeout=None)
                 for key, mask in events:
                     if key.data is None:
                         conn, addr = key.fileobj.accept()
                         # conn.setblocking(False)
-                        data = types.SimpleNamespace(addr=addr, rank=None, size=size)
-                        events = selectors.EVENT_READ | selectors.EVENT_WRITE
                         if debug:
                             conn = _Socket(conn)
+                        data = _new_peer(None, conn, addr=addr)
+                        events = selectors.EVENT_READ
                         sel.register(conn, events, data=data)
                     elif mask & selectors.EVENT_READ:
-                        if key.data.addr not in connected:
+                        if key.data.rank is None:
                             other_rank, = struct.unpack(fmt, Mixin.recv_nbytes(key.fileobj, fmt_len))
                             if authenticate_server_side(key.fileobj, authkey):
                                 key.data.rank = other_rank
-                                connected[key.data.addr] = (other_rank, key.fileobj)
+                                connected[other_rank] = key.fileobj
+                                (mesh_address, mesh_path, token, hosts[other_rank]), _ = Mixin.msg_recv(key.fileobj)
+                                mesh[other_rank] = (mesh_address, mesh_path, token)
                             else:
                                 # print(f"Rank {rank} got wrong authkey from {key.data.addr}. Ignore connection. {outer_authkey} != {authkey}")
                                 pass
-                    elif mask & selectors.EVENT_WRITE:
-                        pass
                     else:
                         raise Exception('Got unexpected mask', mask, 'cannot happen.')
 
                 if len(connected) == size - 1:
-                    return Rootv3(sel, dict(connected), host, port, rank, size, debug)
+                    # The root is connected to all ranks, it needs no
+                    # listener for direct connections.
+                    sel.unregister(lsock)
+                    lsock.close()
+
+                    runtime_dir = path = None
+                    if len(set(hosts)) == 1:
+                        try:
+                            runtime_dir = _runtime_dir()
+                            path = os.path.join(runtime_dir, 'root.sock')
+                            lsock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                            lsock.bind(path)
+                            lsock.listen(size)
+                        except OSError as e:
+                            info(f"Cannot listen on an AF_UNIX socket, use TCP: {e}")
+                            path = None
+                    token = os.urandom(_MESH_TOKEN_LENGTH)
+
+                    # Serialize once, the workers should be released at
+                    # nearly the same time.
+                    frame = Mixin.encode(0, (mesh, hosts, path, token))
+                    for sock in connected.values():
+                        Mixin.sendmsg_all(sock, frame)
+                    if path is not None:
+                        _accept_reconnects(sel, connected, lsock, token, fmt, debug)
+                        lsock.close()
+                    if runtime_dir is not None:
+                        shutil.rmtree(runtime_dir, ignore_errors=True)
+                    return Rootv3(sel, host, port, rank, size, debug, mesh=mesh, token=None, hosts=hosts)
 
         except KeyboardInterrupt:
             raise
@@ -330,12 +1726,22 @@ def establish_connection_v3(host, port, rank, size, *, authkey, debug=False) ->
                     s.connect((host, port))
                     s.sendall(struct.pack(fmt, rank))
                     authenticate_client_side(s, authkey)
+                    listeners, token, runtime_dir = _mesh_listener(s)
+                    (mesh, hosts, path, root_token), _ = Mixin.msg_recv(s)
+                    if path is not None:
+                        s = _reconnect(s, path, struct.pack(fmt, rank) + root_token, debug)
                 except BaseException:
                     s.__exit__(None, None, None)
                     raise
                 if trial >= 50:
                     info(f"{rank} Connected to {host}:{port} after {trial} trials in {time.time() - start_time:.2f}s")
-                return Clientv3(s, host, port, rank, size, debug)
+                sel = selectors.DefaultSelector()
+                sel.register(s, selectors.EVENT_READ, data=_new_peer(0, s))
+                for listener in listeners:
+                    sel.register(listener, selectors.EVENT_READ, data=None)
+                return Clientv3(
+                    sel, host, port, rank, size, debug,
+                    mesh=mesh, token=token, hosts=hosts, runtime_dir=runtime_dir)
             except ConnectionRefusedError as e:
                 if trial < 10:
                     time.sleep(0.01)
@@ -363,6 +1769,11 @@ class _DoctestSocket:
     def sendall(self, data):
         self.other.queue += data
 
+    def sendmsg(self, buffers):
+        data = b''.join(buffers)
+        self.sendall(data)
+        return len(data)
+
     def recv(self, n):
         for i in range(100):
             if self.queue:
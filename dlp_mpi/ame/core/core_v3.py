@@ -1,11 +1,29 @@
+import copy
+import operator
+import socket
+import struct
+import threading
+
 from ..constants import *
-from .logger import info
-from .con_v3 import establish_connection_v3, Clientv3, Rootv3
+from .logger import info as _info
+from .con_v3 import establish_connection_v3, Clientv3, Rootv3, SocketClosed, ProcFailed
 
 
 __all__ = [
     'COMM_WORLD',
     'Status',
+    'Request',
+    'Op',
+    'SUM',
+    'PROD',
+    'MAX',
+    'MIN',
+    'LAND',
+    'LOR',
+    'REPLACE',
+    'NO_OP',
+    'Win',
+    'ProcFailed',
 ]
 
 
@@ -23,6 +41,117 @@ class Status:
     def __init__(self):
         self.source: int = None
         self.tag: int = None
+        self.count: int = None  # The size of the pickled message in bytes
+
+    def Get_source(self):
+        return self.source
+
+    def Get_tag(self):
+        return self.tag
+
+    def Get_count(self):
+        return self.count
+
+
+class Request:
+    """
+    A non-blocking send or receive, i.e. the return value of isend and
+    irecv. Mimics mpi4py.MPI.Request.
+    """
+    def __init__(self, comm, handle, is_recv):
+        self._comm = comm
+        self._handle = handle
+        self._is_recv = is_recv
+
+    def _complete(self, status):
+        if self._handle is None:
+            # Already completed, like an inactive request in MPI.
+            return None
+        obj = self._comm._con.complete(self._handle, status)
+        if status is not None and self._is_recv:
+            status.source = self._comm._local[status.source]
+        self._handle = None
+        return obj
+
+    def wait(self, status=None):
+        if self._handle is not None:
+            self._comm._con.wait([self._handle])
+        return self._complete(status)
+
+    def test(self, status=None):
+        if self._handle is not None and not self._comm._con.wait([self._handle], block=False):
+            return False, None
+        return True, self._complete(status)
+
+    @staticmethod
+    def _active(requests):
+        return [r for r in requests if r._handle is not None]
+
+    @staticmethod
+    def waitall(requests, statuses=None):
+        active = Request._active(requests)
+        if active:
+            active[0]._comm._con.wait([r._handle for r in active])
+        return [
+            r._complete(None if statuses is None else statuses[i])
+            for i, r in enumerate(requests)
+        ]
+
+    @staticmethod
+    def waitany(requests, status=None):
+        active = Request._active(requests)
+        if not active:
+            return UNDEFINED, None
+        active[0]._comm._con.wait([r._handle for r in active], wait_any=True)
+        for index, r in enumerate(requests):
+            if r._handle is not None and r._handle.done:
+                return index, r._complete(status)
+
+    @staticmethod
+    def testall(requests, statuses=None):
+        active = Request._active(requests)
+        if active and not active[0]._comm._con.wait([r._handle for r in active], block=False):
+            return False, None
+        return True, Request.waitall(requests, statuses)
+
+
+class Op:
+    """
+    A reduction operation for reduce and allreduce, like mpi4py.MPI.Op.
+    Any callable, that combines two objects, can be used as op, too.
+    """
+    def __init__(self, function, commute=False):
+        self.function = function
+        self.commute = commute
+
+    def __call__(self, x, y):
+        return self.function(x, y)
+
+    @classmethod
+    def Create(cls, function, commute=False):
+        return cls(function, commute)
+
+
+SUM = Op(operator.add, commute=True)
+PROD = Op(operator.mul, commute=True)
+MAX = Op(max, commute=True)
+MIN = Op(min, commute=True)
+LAND = Op(lambda x, y: x and y, commute=True)
+LOR = Op(lambda x, y: x or y, commute=True)
+# For Fetch_and_op: Replace the value of the target or only read it.
+REPLACE = Op(lambda x, y: y)
+NO_OP = Op(lambda x, y: x)
+
+# The numpy ufuncs of the ops, that Allreduce, Reduce_scatter and Allgather
+# apply along a ring. Other ops use the object collectives.
+_UFUNCS = {SUM: 'add', PROD: 'multiply', MAX: 'maximum', MIN: 'minimum', LAND: 'logical_and', LOR: 'logical_or'}
+
+
+def _ufunc(op):
+    if op in _UFUNCS:
+        import numpy as np
+        return getattr(np, _UFUNCS[op])
+    return None
 
 
 class Communicator_v3:
@@ -47,6 +176,16 @@ class Communicator_v3:
         self._host = host
         self._port = port
         self._authkey = authkey
+        # All communicators share the connections of COMM_WORLD, the context
+        # separates their messages.
+        self._context = 0
+        # The rank of the connection (i.e. in COMM_WORLD) for each rank of
+        # this communicator and the inverse. Identity for COMM_WORLD.
+        self._ranks = range(size)
+        self._local = range(size)
+        # The acknowledged failed ranks (in COMM_WORLD), see Ack_failed.
+        # None: Failures are not reported.
+        self._acked = None
 
         if self.size > 1:
             assert isinstance(port, int), (port, type(port))
@@ -60,45 +199,553 @@ class Communicator_v3:
             )
         else:
             class DummyCon:
-                def send(self, obj, dest, tag=0):
+                next_context = 1
+                lost = []
+
+                def send(self, obj, dest, tag=0, context=0):
                     # Dummy implementation for bcast
                     assert dest == [], dest
 
-                def recv(self, source, tag=ANY_TAG, status=None):
+                def recv(self, source, tag=ANY_TAG, status=None, context=0, interrupt=None):
                     # Dummy implementation for gather
                     assert source == [], source
                     return {}
+
+                def probe(self, source, tag=ANY_TAG, status=None, context=0, block=True, interrupt=None):
+                    # There is no other rank, hence there are no messages.
+                    assert not block, 'probe would block forever'
+                    return False
             self._con: 'Clientv3 | Rootv3' = DummyCon()
 
+    def _send(self, obj, dest, tag):
+        if isinstance(dest, int):
+            dest = self._ranks[dest]
+        else:
+            dest = [self._ranks[d] for d in dest]
+        try:
+            self._con.send(obj, dest, tag, context=self._context)
+        except SocketClosed:
+            if self._acked is None:
+                raise
+            raise ProcFailed(f"Cannot send to {dest}, the rank is lost.") from None
+
+    def _failed(self):
+        # The failed ranks of this communicator (in COMM_WORLD).
+        return [r for r in self._con.lost if r in self._local]
+
+    def _interrupt(self, source):
+        # With Ack_failed: A receive from ANY_SOURCE is interrupted by a
+        # failure, that is not yet acknowledged.
+        if self._acked is None or source != ANY_SOURCE:
+            return None
+        return lambda: any(r not in self._acked for r in self._failed())
+
+    def _recv(self, source, tag=ANY_TAG, status=None):
+        if isinstance(source, int):
+            obj = self._con.recv(
+                source if source == ANY_SOURCE else self._ranks[source],
+                tag, status, context=self._context,
+                interrupt=self._interrupt(source))
+            if status is not None:
+                status.source = self._local[status.source]
+            return obj
+        objs = self._con.recv([self._ranks[s] for s in source], tag, context=self._context)
+        return {self._local[r]: obj for r, obj in objs.items()}
+
+    def _probe(self, source, tag, status, block):
+        found = self._con.probe(
+            source if source == ANY_SOURCE else self._ranks[source],
+            tag, status, context=self._context, block=block,
+            interrupt=self._interrupt(source))
+        if found and status is not None:
+            status.source = self._local[status.source]
+        return found
+
     def send(self, obj, dest, tag=0):
         assert isinstance(dest, int), (dest, type(dest))
-        self._con.send(obj, dest, tag)
+        self._send(obj, dest, tag)
 
     def recv(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        """
+        Receive the oldest message from source with tag. Messages, that do
+        not match, stay in the queue of this communicator.
+
+        probe and iprobe report the source, the tag and the size in bytes
+        of a message without receiving it.
+
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     if rank == 1:
+        ...         comm.send('a', 0, tag=1)
+        ...         comm.send(b'b' * 1000, 0, tag=2)
+        ...     comm.barrier()
+        ...     if rank == 0:
+        ...         status = Status()
+        ...         out = [comm.iprobe(tag=3), comm.probe(tag=2, status=status)]
+        ...         out += [status.source, status.tag, status.count > 1000]
+        ...         return out, len(comm.recv(tag=2)), comm.recv(1, tag=ANY_TAG)
+        >>> thread_based_test(test, 2)[0]
+        Wait for thread 1
+        Thread 1 finished
+        ([False, True, 1, 2, True], 1000, 'a')
+        """
+        assert isinstance(source, int), (source, type(source))
+        return self._recv(source, tag, status)
+
+    def isend(self, obj, dest, tag=0):
+        """
+        Start to send obj and return a Request. A thread writes the message,
+        while the caller computes. Large numpy arrays are not copied, i.e.
+        they must not be changed, until the request is done.
+
+        >>> import time
+        >>> import numpy as np
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     if rank == 0:
+        ...         start = time.perf_counter()
+        ...         data = comm.recv(1)
+        ...         received = time.perf_counter() - start
+        ...         comm.send('a', 1, tag=3)
+        ...         comm.send('b', 1, tag=2)
+        ...         return received < 0.4, int(data.sum())
+        ...     request = comm.isend(np.ones(100_000), 0)  # Larger than the socket buffer
+        ...     time.sleep(0.5)  # Compute something
+        ...     out = [request.test()]
+        ...     requests = [comm.irecv(source=0, tag=2), comm.irecv(source=0, tag=3)]
+        ...     return out + [Request.waitall(requests)]
+        >>> out = thread_based_test(test, 2)
+        Wait for thread 1
+        Thread 1 finished
+        >>> out[0], out[1]
+        ((True, 100000), [(True, None), ['b', 'a']])
+        """
+        assert isinstance(dest, int), (dest, type(dest))
+        handle = self._con.isend(obj, self._ranks[dest], tag, context=self._context)
+        return Request(self, handle, is_recv=False)
+
+    def irecv(self, buf=None, source=ANY_SOURCE, tag=ANY_TAG):
+        """
+        Post a receive and return a Request. A thread receives the message,
+        while the caller computes. buf is ignored, it exists for
+        compatibility with mpi4py.
+        """
+        assert isinstance(source, int), (source, type(source))
+        handle = self._con.irecv(
+            source if source == ANY_SOURCE else self._ranks[source],
+            tag, context=self._context)
+        return Request(self, handle, is_recv=True)
+
+    def probe(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        """
+        Wait for a message from source with tag, but do not receive it.
+        """
         assert isinstance(source, int), (source, type(source))
-        return self._con.recv(source, tag, status)
+        return self._probe(source, tag, status, block=True)
+
+    def iprobe(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        """
+        Whether a message from source with tag is available.
+        """
+        assert isinstance(source, int), (source, type(source))
+        return self._probe(source, tag, status, block=False)
+
+    # Below this number of ranks, bcast and gather use a star, i.e. the root
+    # sends to/receives from each rank. From this number on, they use a
+    # binomial tree over the direct connections between the ranks, so the
+    # latency grows with log2(size) and the root sends/receives only
+    # log2(size) messages.
+    _TREE_MIN_SIZE = 32
+
+    def _tree(self, root):
+        """
+        The parent and the children of this rank in a binomial tree.
+
+        >>> comm = Communicator_v3(rank=0, size=1, port=None, host=None, authkey=None)
+        >>> for rank in range(6):
+        ...     comm.rank = rank
+        ...     comm.size = 6
+        ...     print(rank, *comm._tree(root=0))
+        0 None [4, 2, 1]
+        1 0 []
+        2 0 [3]
+        3 2 []
+        4 0 [5]
+        5 4 []
+        >>> comm.rank = 0
+        >>> print(*comm._tree(root=2))  # Relative rank 4
+        2 [1]
+        """
+        vrank = (self.rank - root) % self.size
+
+        mask = 1
+        parent = None
+        while mask < self.size:
+            if vrank & mask:
+                parent = (vrank - mask + root) % self.size
+                break
+            mask <<= 1
+
+        children = []
+        mask >>= 1
+        while mask > 0:
+            if vrank + mask < self.size:
+                children.append((vrank + mask + root) % self.size)
+            mask >>= 1
+        return parent, children
 
     def bcast(self, obj, root=0, _tag=BCAST_TAG):
+        """
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     comm._TREE_MIN_SIZE = 2
+        ...     data = comm.bcast({'rank': rank} if rank == 2 else None, root=2)
+        ...     return data, comm.gather(rank * 10, root=2)
+        >>> out = thread_based_test(test, 6)  # doctest: +ELLIPSIS
+        Wait for thread 1
+        ...
+        Thread 5 finished
+        >>> for rank, o in sorted(out.items()):
+        ...     print(rank, *o)
+        0 {'rank': 2} None
+        1 {'rank': 2} None
+        2 {'rank': 2} [0, 10, 20, 30, 40, 50]
+        3 {'rank': 2} None
+        4 {'rank': 2} None
+        5 {'rank': 2} None
+        """
+        if self.size >= self._TREE_MIN_SIZE:
+            parent, children = self._tree(root)
+            if parent is not None:
+                obj = self._recv(parent, _tag)
+            if children:
+                self._send(obj, children, _tag)
+            return obj
         if self.rank == root:
             dest = [i for i in range(self.size) if i != root]
-            self._con.send(obj, dest, tag=_tag)
+            self._send(obj, dest, _tag)
             return obj
         else:
-            return self._con.recv(source=root)
+            return self._recv(root, _tag)
 
     def gather(self, obj, root=0, _tag=GATHER_TAG):
+        if self.size >= self._TREE_MIN_SIZE:
+            # Each rank collects the objects of its subtree and sends them
+            # to the parent.
+            parent, children = self._tree(root)
+            objs = {self.rank: obj}
+            if children:
+                for sub in self._recv(children, _tag).values():
+                    if _tag != BARRIER_TAG:
+                        objs.update(sub)
+            if parent is not None:
+                self._send(None if _tag == BARRIER_TAG else objs, parent, _tag)
+                return None
+            if _tag == BARRIER_TAG:
+                return [None] * self.size
+            return [objs[i] for i in range(self.size)]
         if self.rank == root:
             source = [i for i in range(self.size) if i != root]
-            ret = self._con.recv(source)
+            ret = self._recv(source, _tag)
             ret = [
                 ret[i] if i != root else obj
                 for i in range(0, self.size)
             ]
             return ret
         else:
-            self._con.send(obj, root, tag=_tag)
+            self._send(obj, root, _tag)
             return None
 
+    def _subtree(self, child, root):
+        """
+        The ranks in the subtree of a child in the binomial tree of root.
+        """
+        vchild = (child - root) % self.size
+        end = min(vchild + (vchild & -vchild), self.size)
+        return [(v + root) % self.size for v in range(vchild, end)]
+
+    def scatter(self, sendobj, root=0):
+        """
+        The root sends sendobj[i] to rank i.
+
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     out = [comm.scatter([i * 10 for i in range(size)] if rank == 1 else None, root=1)]
+        ...     comm._TREE_MIN_SIZE = 2
+        ...     out.append(comm.scatter([i * 10 for i in range(size)] if rank == 1 else None, root=1))
+        ...     return out
+        >>> out = thread_based_test(test, 6)  # doctest: +ELLIPSIS
+        Wait for thread 1
+        ...
+        Thread 5 finished
+        >>> [out[rank] for rank in range(6)]
+        [[0, 0], [10, 10], [20, 20], [30, 30], [40, 40], [50, 50]]
+        """
+        if self.rank == root:
+            sendobj = list(sendobj)
+            assert len(sendobj) == self.size, (len(sendobj), self.size)
+        if self.size >= self._TREE_MIN_SIZE:
+            # Each rank gets the objects of its subtree from the parent and
+            # forwards them to the children.
+            parent, children = self._tree(root)
+            if parent is None:
+                objs = dict(enumerate(sendobj))
+            else:
+                objs = self._recv(parent, SCATTER_TAG)
+            for child in children:
+                self._send({r: objs.pop(r) for r in self._subtree(child, root)}, child, SCATTER_TAG)
+            return objs[self.rank]
+        if self.rank == root:
+            for rank, obj in enumerate(sendobj):
+                if rank != root:
+                    self._send(obj, rank, SCATTER_TAG)
+            return sendobj[root]
+        else:
+            return self._recv(root, SCATTER_TAG)
+
+    def allgather(self, sendobj):
+        """
+        Like gather, but all ranks get the list.
+        """
+        return self.bcast(self.gather(sendobj))
+
+    def reduce(self, sendobj, op=SUM, root=0):
+        """
+        Combine the objects of all ranks with op, the root gets the result.
+
+        The objects are combined along a binomial tree, i.e. each rank
+        combines the partial results of its subtree and sends only one
+        object to its parent. The operands are combined in the order of
+        the ranks, i.e. op has to be associative, but not commutative.
+
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     concat = Op.Create(lambda x, y: x + y)
+        ...     return (comm.reduce(rank, root=2), comm.reduce([rank], op=concat),
+        ...             comm.allreduce(rank, op=MAX), comm.allgather(rank))
+        >>> out = thread_based_test(test, 6)  # doctest: +ELLIPSIS
+        Wait for thread 1
+        ...
+        Thread 5 finished
+        >>> for rank, o in sorted(out.items()):
+        ...     print(rank, *o)
+        0 None [0, 1, 2, 3, 4, 5] 5 [0, 1, 2, 3, 4, 5]
+        1 None None 5 [0, 1, 2, 3, 4, 5]
+        2 15 None 5 [0, 1, 2, 3, 4, 5]
+        3 None None 5 [0, 1, 2, 3, 4, 5]
+        4 None None 5 [0, 1, 2, 3, 4, 5]
+        5 None None 5 [0, 1, 2, 3, 4, 5]
+        """
+        # The tree of rank 0 keeps the order of the ranks. Another root
+        # gets the result from rank 0.
+        parent, children = self._tree(0)
+        result = sendobj
+        for child in reversed(children):
+            # Ascending ranks. Receive one partial result at a time.
+            result = op(result, self._recv(child, REDUCE_TAG))
+        if parent is not None:
+            self._send(result, parent, REDUCE_TAG)
+            result = None
+        if root != 0:
+            if self.rank == 0:
+                self._send(result, root, REDUCE_TAG)
+                result = None
+            elif self.rank == root:
+                result = self._recv(0, REDUCE_TAG)
+        return result
+
+    def allreduce(self, sendobj, op=SUM):
+        """
+        Like reduce, but all ranks get the result.
+        """
+        return self.bcast(self.reduce(sendobj, op))
+
+    def alltoall(self, sendobj):
+        """
+        Each rank sends sendobj[i] to rank i and gets a list with the
+        objects, that the ranks sent to it.
+
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     return comm.alltoall([f'{rank}->{i}' for i in range(size)])
+        >>> out = thread_based_test(test, 3)  # doctest: +ELLIPSIS
+        Wait for thread 1
+        ...
+        Thread 2 finished
+        >>> [out[rank] for rank in range(3)]
+        [['0->0', '1->0', '2->0'], ['0->1', '1->1', '2->1'], ['0->2', '1->2', '2->2']]
+        """
+        sendobj = list(sendobj)
+        assert len(sendobj) == self.size, (len(sendobj), self.size)
+        # Shift the destinations, so not all ranks send to the same rank
+        # at the same time.
+        others = [(self.rank + i) % self.size for i in range(1, self.size)]
+        for rank in others:
+            self._send(sendobj[rank], rank, ALLTOALL_TAG)
+        objs = self._recv(others, ALLTOALL_TAG)
+        objs[self.rank] = sendobj[self.rank]
+        return [objs[rank] for rank in range(self.size)]
+
+    # Below this size of an array, Allreduce, Reduce_scatter and Allgather
+    # use the object collectives, because the 2 * (size - 1) steps of the
+    # ring cost more than the transfer.
+    _RING_MIN_NBYTES = 65536
+
+    def _ring_reduce_scatter(self, chunks, ufunc):
+        """
+        Each rank sends a chunk to its right neighbour, that combines it
+        with its own chunk and sends it further. After size - 1 steps,
+        chunks[rank] is combined over all ranks.
+        """
+        left, right = (self.rank - 1) % self.size, (self.rank + 1) % self.size
+        for step in range(self.size - 1):
+            self._send(chunks[(self.rank - step - 1) % self.size], right, RING_TAG)
+            chunk = chunks[(self.rank - step - 2) % self.size]
+            ufunc(chunk, self._recv(left, RING_TAG), out=chunk)
+
+    def _ring_allgather(self, chunks):
+        """
+        Each rank sends chunks[rank] around the ring, i.e. each rank
+        receives the chunks of all other ranks in size - 1 steps.
+        """
+        left, right = (self.rank - 1) % self.size, (self.rank + 1) % self.size
+        for step in range(self.size - 1):
+            self._send(chunks[(self.rank - step) % self.size], right, RING_TAG)
+            chunks[(self.rank - step - 1) % self.size][...] = self._recv(left, RING_TAG)
+
+    def Allreduce(self, sendbuf, recvbuf, op=SUM):
+        """
+        Like allreduce, but for numpy arrays: recvbuf is filled with the
+        result. sendbuf can be IN_PLACE, then the input is the recvbuf.
+
+        The array is split into one chunk per rank. A ring reduce-scatter
+        and a ring allgather of the chunks send 2 * (size - 1) / size times
+        the array from each rank, independent of the number of ranks.
+
+        >>> import numpy as np
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     comm._RING_MIN_NBYTES = 0
+        ...     a = np.arange(10.) * (rank + 1)
+        ...     total, maximum, gathered, part = np.zeros(10), a.copy(), np.zeros((size, 2)), np.zeros(4)
+        ...     comm.Allreduce(a, total)
+        ...     comm.Allreduce(IN_PLACE, maximum, op=MAX)
+        ...     comm.Allgather(a[:2], gathered)
+        ...     comm.Reduce_scatter(a, part, recvcounts=[4, 4, 2])
+        ...     return total, maximum, gathered.tolist(), part
+        >>> out = thread_based_test(test, 3)
+        Wait for thread 1
+        Thread 1 finished
+        Wait for thread 2
+        Thread 2 finished
+        >>> out[2][0]  # total
+        array([ 0.,  6., 12., 18., 24., 30., 36., 42., 48., 54.])
+        >>> out[2][1]  # maximum
+        array([ 0.,  3.,  6.,  9., 12., 15., 18., 21., 24., 27.])
+        >>> out[2][2]  # gathered
+        [[0.0, 1.0], [0.0, 2.0], [0.0, 3.0]]
+        >>> out[0][3], out[1][3], out[2][3]
+        (array([ 0.,  6., 12., 18.]), array([24., 30., 36., 42.]), array([48., 54.,  0.,  0.]))
+        """
+        import numpy as np
+        out = recvbuf.reshape(-1)
+        assert np.shares_memory(out, recvbuf), 'recvbuf has to be contiguous'
+        if sendbuf is not IN_PLACE:
+            np.copyto(out, np.asarray(sendbuf).reshape(-1))
+        if self.size == 1:
+            return
+        ufunc = _ufunc(op)
+        if ufunc is None or out.nbytes < self._RING_MIN_NBYTES:
+            out[...] = self.allreduce(out, op if ufunc is None else Op(ufunc, commute=True))
+            return
+        chunks = np.array_split(out, self.size)
+        self._ring_reduce_scatter(chunks, ufunc)
+        self._ring_allgather(chunks)
+
+    def Reduce_scatter(self, sendbuf, recvbuf, recvcounts=None, op=SUM):
+        """
+        Combine the numpy arrays sendbuf of all ranks with op and split the
+        result: rank i gets recvcounts[i] elements in recvbuf. Default: The
+        same number for each rank.
+        """
+        import numpy as np
+        work = np.array(sendbuf).reshape(-1)
+        if recvcounts is None:
+            assert work.size % self.size == 0, (work.size, self.size)
+            recvcounts = [work.size // self.size] * self.size
+        assert sum(recvcounts) == work.size, (recvcounts, work.size)
+        chunks = np.split(work, np.cumsum(recvcounts)[:-1])
+        if self.size > 1:
+            ufunc = _ufunc(op)
+            if ufunc is None or work.nbytes < self._RING_MIN_NBYTES:
+                work[...] = self.allreduce(work, op if ufunc is None else Op(ufunc, commute=True))
+            else:
+                self._ring_reduce_scatter(chunks, ufunc)
+        recvbuf.reshape(-1)[:recvcounts[self.rank]] = chunks[self.rank]
+
+    def Allgather(self, sendbuf, recvbuf):
+        """
+        Like allgather, but for numpy arrays: recvbuf has size times the
+        elements of sendbuf and gets the sendbuf of rank i at position i.
+        """
+        import numpy as np
+        out = recvbuf.reshape(-1)
+        assert np.shares_memory(out, recvbuf), 'recvbuf has to be contiguous'
+        chunks = np.split(out, self.size)
+        chunks[self.rank][...] = np.asarray(sendbuf).reshape(-1)
+        if self.size == 1:
+            return
+        if out.nbytes < self._RING_MIN_NBYTES:
+            out[...] = np.concatenate(self.allgather(chunks[self.rank]))
+            return
+        self._ring_allgather(chunks)
+
+    def get_failed(self):
+        """
+        The ranks of this communicator, whose connections are closed, e.g.
+        the process was killed or has finished. Like Get_failed of MPI
+        with fault tolerance (ULFM), but returns a list instead of a group.
+        """
+        return [self._local[r] for r in self._failed()]
+
+    def ack_failed(self, num_to_ack=None):
+        """
+        Acknowledge the first num_to_ack (default: all) failed ranks and
+        return the number of acknowledged ranks. After the first call, a
+        receive or probe from ANY_SOURCE raises ProcFailed, instead of
+        waiting forever, when a rank failed, that is not acknowledged, and
+        a send to a failed rank raises ProcFailed. Use ack_failed(0) to
+        enable the reports.
+
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     if rank == 1:
+        ...         for peer in comm._con.peers.values():
+        ...             peer.sock.close()  # Like a killed process
+        ...     elif rank == 0:
+        ...         comm.Ack_failed(0)
+        ...         try:
+        ...             comm.recv()
+        ...         except ProcFailed:
+        ...             return comm.Get_failed(), comm.Ack_failed()
+        >>> thread_based_test(test, 2)[0]
+        Wait for thread 1
+        Thread 1 finished
+        ([1], 1)
+        """
+        failed = self._failed()
+        acked = failed if num_to_ack is None else failed[:num_to_ack]
+        self._acked = frozenset(acked)
+        return len(acked)
+
     def barrier(self):
         # Note: This is a naive implementation.
         #       The BARRIER_TAG is used for an improved implementation,
@@ -107,26 +754,216 @@ class Communicator_v3:
         self.gather(None, _tag=BARRIER_TAG)
 
     def clone(self):
-        from ._init.common import find_free_port, get_authkey
-        port = find_free_port() if self.rank == 0 else None
-        authkey = get_authkey(force_random=True) if self.rank == 0 else None
+        """
+        The clone uses the same connections, but its messages are separated
+        from the messages of this communicator by a new context.
 
-        # bcast and gather act as barrier
-        port, authkey = self.bcast([port, authkey])
-        self.gather(None, _tag=BARRIER_TAG)
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     clone = comm.Clone()
+        ...     if rank == 1:
+        ...         comm.send('comm', 0)
+        ...         clone.send('clone', 0)
+        ...     elif rank == 0:
+        ...         return clone.recv(1), comm.recv(1), clone._con is comm._con
+        >>> thread_based_test(test, 2)[0]
+        Wait for thread 1
+        Thread 1 finished
+        ('clone', 'comm', True)
+        """
+        # Agree on a context, that is not used on any rank. gather and bcast
+        # act as barrier.
+        contexts = self.gather(self._con.next_context)
+        context = self.bcast(max(contexts) if self.rank == 0 else None)
+        self._con.next_context = context + 1
+        return self._derive(context)
+
+    def split(self, color=0, key=0):
+        """
+        Split the communicator into groups of the ranks with the same color.
+        The ranks of a group are ordered by key and then by their rank in
+        this communicator. Returns None for the color UNDEFINED.
+
+        All groups use the same connections and a new context, hence the
+        collectives of a group involve only the ranks of the group.
 
-        return self.__class__(
-            rank=self.rank,
-            size=self.size,
-            port=port,
-            host=self._host,
-            authkey=authkey,
-            depth=self._depth + 1,
-            debug=self._debug,
-        )
+        >>> from dlp_mpi.ame.testing import thread_based_test
+        >>> def test(host, port, rank, size, authkey):
+        ...     comm = Communicator_v3(rank, size, port, host, authkey)
+        ...     group = comm.Split(rank % 2, key=-rank)
+        ...     out = group.rank, group.size, group.gather(rank), group.bcast(rank)
+        ...     return out, comm.Split(UNDEFINED if rank == 0 else 0) is None
+        >>> out = thread_based_test(test, 5)  # doctest: +ELLIPSIS
+        Wait for thread 1
+        ...
+        Thread 4 finished
+        >>> for rank, o in sorted(out.items()):
+        ...     print(rank, o)
+        0 ((2, 3, None, 4), True)
+        1 ((1, 2, None, 3), False)
+        2 ((1, 3, None, 4), False)
+        3 ((0, 2, [3, 1], 3), False)
+        4 ((0, 3, [4, 2, 0], 4), False)
+        """
+        # Agree on the groups and on a context, that is not used on any
+        # rank of this communicator.
+        entries = self.gather((color, key, self._con.next_context))
+        if self.rank == 0:
+            groups = {}
+            for rank, (c, k, _) in enumerate(entries):
+                if c != UNDEFINED:
+                    groups.setdefault(c, []).append((k, rank))
+            groups = {c: [rank for _, rank in sorted(g)] for c, g in groups.items()}
+            context = max(next_context for _, _, next_context in entries)
+        else:
+            groups = context = None
+        groups, context = self.bcast((groups, context))
+        self._con.next_context = context + 1
+        if color == UNDEFINED:
+            return None
+        return self._derive(context, groups[color])
+
+    def split_type(self, split_type, key=0):
+        """
+        Split the communicator by the type. Only COMM_TYPE_SHARED is
+        supported, i.e. the groups are the ranks on the same host.
+        """
+        if split_type == UNDEFINED:
+            return self.split(UNDEFINED, key)
+        assert split_type == COMM_TYPE_SHARED, (split_type, COMM_TYPE_SHARED)
+        return self.split(socket.gethostname(), key)
 
+    def _derive(self, context, ranks=None):
+        """
+        A new communicator with the context. ranks are the ranks of this
+        communicator, that form the new communicator. Default: all.
+        """
+        comm = copy.copy(self)
+        comm._context = context
+        comm._depth = self._depth + 1
+        if ranks is not None:
+            comm._ranks = [self._ranks[rank] for rank in ranks]
+            comm._local = {r: i for i, r in enumerate(comm._ranks)}
+            comm.rank = ranks.index(self.rank)
+            comm.size = len(ranks)
+        return comm
+
+    Ack_failed = ack_failed
     Barrier = barrier
     Clone = clone
+    Get_failed = get_failed
+    Probe = probe
+    Iprobe = iprobe
+    Split = split
+    Split_type = split_type
+
+
+class Win:
+    """
+    A window of memory, that the other ranks access with Fetch_and_op.
+    Mimics mpi4py.MPI.Win with passive target synchronization, but only
+    the atomic Fetch_and_op of a single element is supported, e.g. for a
+    shared counter.
+
+    The connections have no one-sided communication, hence the target
+    applies the operation, when it receives the request. While a window
+    has memory on a rank, the progress thread of that rank keeps running,
+    i.e. it serves the requests, while the rank computes.
+
+    >>> from array import array
+    >>> from dlp_mpi.ame.testing import thread_based_test
+    >>> def test(host, port, rank, size, authkey):
+    ...     comm = Communicator_v3(rank, size, port, host, authkey)
+    ...     memory = array('q', [0, 0]) if rank == 0 else None
+    ...     win = Win.Create(memory, disp_unit=8, comm=comm)
+    ...     win.Lock_all()
+    ...     one, result, claimed = array('q', [1]), array('q', [0]), []
+    ...     for _ in range(3):
+    ...         win.Fetch_and_op(one, result, 0, target_disp=1)
+    ...         win.Flush(0)
+    ...         claimed.append(result[0])
+    ...     win.Fetch_and_op(array('q', [rank]), result, 0, op=MAX)
+    ...     win.Unlock_all()
+    ...     win.Free()
+    ...     return claimed, memory
+    >>> out = thread_based_test(test, 3)
+    Wait for thread 1
+    Thread 1 finished
+    Wait for thread 2
+    Thread 2 finished
+    >>> sorted(c for claimed, _ in out.values() for c in claimed), out[0][1]
+    ([0, 1, 2, 3, 4, 5, 6, 7, 8], array('q', [2, 9]))
+    """
+    # The ops, that Fetch_and_op supports. A request contains the index.
+    _OPS = [SUM, PROD, MAX, MIN, REPLACE, NO_OP]
+
+    def __init__(self, comm, memory, disp_unit):
+        self._comm = comm
+        self._memory = None if memory is None else memoryview(memory).cast('B')
+        self._disp_unit = disp_unit
+        self._mutex = threading.Lock()
+
+    @classmethod
+    def Create(cls, memory, disp_unit=1, info=None, comm=None):
+        """
+        Collective: Each rank exposes its memory (a writable buffer or
+        None) to the other ranks of comm. info is ignored (mpi4py
+        signature).
+        """
+        # The requests and replies of the window use their own context.
+        comm = comm.Clone()
+        win = cls(comm, memory, disp_unit)
+        if win._memory is not None and comm.size > 1:
+            comm._con.expose(comm._context, win._serve)
+        # No rank may send a request, before the targets expose the memory.
+        comm.Barrier()
+        return win
+
+    def _serve(self, request):
+        disp, fmt, value, op = request
+        offset = disp * self._disp_unit
+        view = self._memory[offset:offset + struct.calcsize(fmt)].cast(fmt)
+        with self._mutex:
+            old = view[0]
+            view[0] = self._OPS[op](old, value)
+        return old
+
+    def Fetch_and_op(self, origin, result, target_rank, target_disp=0, op=SUM):
+        """
+        Combine the element of the origin buffer with the element at
+        target_disp (in units of the disp_unit of the target) in the memory
+        of target_rank and return the previous value in the result buffer.
+        """
+        fmt = memoryview(origin).format
+        value, = memoryview(origin).cast('B').cast(fmt)
+        request = (target_disp, fmt, value, self._OPS.index(op))
+        if target_rank == self._comm.rank:
+            old = self._serve(request)
+        else:
+            self._comm._send(request, target_rank, WIN_TAG)
+            old = self._comm._recv(target_rank, WIN_REPLY_TAG)
+        memoryview(result).cast('B').cast(fmt)[0] = old
+
+    def Lock_all(self):
+        # Each Fetch_and_op is atomic and completed, when it returns.
+        pass
+
+    def Unlock_all(self):
+        pass
+
+    def Flush(self, rank):
+        pass
+
+    def Free(self):
+        """
+        Collective: Wait for all ranks, then the memory is no longer
+        exposed.
+        """
+        self._comm.Barrier()
+        if self._memory is not None and self._comm.size > 1:
+            self._comm._con.hide(self._comm._context)
+        self._memory = None
 
 
 Communicator = Communicator_v3
@@ -1,6 +1,11 @@
+import collections
+import sys
+import traceback
+
 import dlp_mpi
-from dlp_mpi import MPI, COMM
+from dlp_mpi import COMM
 from dlp_mpi.mpi import RankInt
+from dlp_mpi.scheduler import Scheduler
 
 __all__ = [
     'map_unordered',
@@ -15,6 +20,13 @@ def map_unordered(
         pbar_prefix=None,
         indexable=True,
         comm=None,
+        root_as_worker=False,
+        ship_items=False,
+        retries=0,
+        failures=None,
+        speculative=False,
+        journal=None,
+        resume=False,
 ):
     """
     Similar to the builtin function map, but the function is executed on the
@@ -29,12 +41,47 @@ def map_unordered(
     indexable can be set to False and the worker iterates through the
     sequence to get the correct item. In this case it is recommended that
     iterating through the sequence is fast.
+    With ship_items, only the master iterates through the sequence and
+    sends each item with the task, i.e. the items have to be picklable.
 
     Requires at least 2 mpi processes, but to gain a speedup 3 are needed.
+    With root_as_worker, the master also executes func and answers the
+    requests of the workers between two calls, hence 2 processes give a
+    speedup. When the master fails, the workers are stopped.
     Only rank 0 gets the results.
     This map is lazy. When the master process blocks in the for loop, the
     master process cannot submit new tasks to the workers.
 
+    By default, when func fails on a worker, the worker stops and the
+    master raises an AssertionError at the end. With retries or a failures
+    list, the exception (of func or of the getitem) is caught for each item
+    and the worker continues. The master assigns the failed item up to
+    retries times again, preferably to another worker. Items, that failed
+    retries + 1 times, are appended to failures as
+    dict(index=..., ranks=[...], errors=[...]) (the ranks and the formatted
+    tracebacks) instead of raising an AssertionError. Retries need an
+    indexable sequence with a length or ship_items.
+
+    With the ame backend, the master also detects workers, that die without
+    an exception (e.g. a killed process). Their task is assigned to another
+    worker (counts as failed attempt with retries), when the sequence is
+    indexable or with ship_items. Without retries, only workers, that have
+    not yet stopped, get the task.
+
+    With speculative, idle workers get a duplicate of the task, that runs
+    the longest time, when all tasks are assigned (straggler mitigation).
+    The first result is yielded, the late duplicate is discarded, i.e.
+    each result is yielded once, but func may run twice for an item.
+    Needs an indexable sequence with a length or ship_items and cannot be
+    combined with retries or failures.
+
+    With a journal path, the master appends the index of each result to
+    that file (checkpoint, see dlp_mpi.util.Journal). With resume, the
+    indices in the journal are skipped, e.g. when the job was killed,
+    because of the walltime, the restarted script processes only the
+    remaining items, i.e. func should save its results. Without resume,
+    the journal is cleared.
+
     Assume function body is fast.
 
     Parallel: The execution of func.
@@ -58,6 +105,54 @@ def map_unordered(
     rank = RankInt(comm.rank)
     size = comm.size
 
+    recover = retries > 0 or failures is not None
+    if retries:
+        assert indexable or ship_items, (indexable, ship_items)
+    if speculative:
+        assert (indexable or ship_items) and not recover, (indexable, ship_items, recover)
+    assert journal is not None or not resume, (journal, resume)
+    # With resume: The indices, that are already processed.
+    completed = set()
+    if resume and rank == 0:
+        completed = dlp_mpi.util.Journal.load(journal)
+
+    if size == 1 and (recover or journal is not None):
+        def attempt(val):
+            try:
+                return True, func(val)
+            except Exception:
+                if not recover:
+                    raise
+                return False, traceback.format_exc()
+
+        def local():
+            with dlp_mpi.util.Journal(journal, resume) as writer:
+                for index, val in enumerate(sequence):
+                    if index in completed:
+                        continue
+                    errors = []
+                    for _ in range(retries + 1):
+                        successful, result = attempt(val)
+                        if successful:
+                            writer.add(index)
+                            yield result
+                            break
+                        errors.append(result)
+                    else:
+                        entry = dict(index=index, ranks=[0] * len(errors), errors=errors)
+                        if failures is None:
+                            raise AssertionError(f'Failed for index {index}:\n{errors[-1]}')
+                        failures.append(entry)
+        if progress_bar:
+            try:
+                total = len(sequence) - len(completed)
+            except TypeError:
+                total = None
+            yield from tqdm(local(), total=total)
+        else:
+            yield from local()
+        return
+
     if size == 1:
         if progress_bar:
             try:
@@ -71,94 +166,352 @@ def map_unordered(
             return
 
 
-    status = MPI.Status()
-    workers = size - 1
-
     class tags(IntEnum):
         """Avoids magic constants."""
         start = auto()
         stop = auto()
         default = auto()
         failed = auto()
+        # With retries or failures: func failed, the worker continues.
+        error = auto()
 
     # dlp_mpi.barrier()
 
     if rank == 0:
-        i = 0
-
-        failed_indices = []
-
-        if pbar_prefix is None:
-            pbar_prefix = ''
-        else:
-            pbar_prefix = f'{pbar_prefix}, '
+        try:
+            total = len(sequence)
+        except TypeError:
+            total = None
+        if (retries or speculative) and not ship_items:
+            assert total is not None, 'retries need the length of the sequence'
 
         with dlp_mpi.util.progress_bar(
                 sequence=sequence,
                 display_progress_bar=progress_bar,
-        ) as pbar:
-            pbar.set_description(f'{pbar_prefix}busy: {workers}')
-            while workers > 0:
-                result = comm.recv(
-                    source=MPI.ANY_SOURCE,
-                    tag=MPI.ANY_TAG,
-                    status=status)
-                if status.tag in [tags.default, tags.start]:
-                    comm.send(i, dest=status.source)
-                    i += 1
-                if status.tag in [tags.default]:
-                    yield result
-                if status.tag in [tags.default, tags.failed]:
-                    pbar.update()
-
-                if status.tag in [tags.stop, tags.failed]:
-                    workers -= 1
-                    if progress_bar:
-                        pbar.set_description(f'{pbar_prefix}busy: {workers}')
-                if status.tag in [tags.failed]:
-                    last_index = result
-                    failed_indices += [(status.source, last_index)]
+                total=None if total is None else total - len(completed),
+        ) as pbar, dlp_mpi.util.Journal(journal, resume) as writer:
+            scheduler = _TaskScheduler(
+                comm,
+                pbar,
+                writer,
+                tags,
+                pbar_prefix=pbar_prefix,
+                retries=retries,
+                recover=recover,
+                requeue=indexable or ship_items,
+                track=recover or speculative or journal is not None,
+                speculative=speculative,
+                total=total,
+                completed=completed,
+                iterator=iter(sequence) if ship_items else None,
+            )
+            try:
+                if root_as_worker:
+                    items = enumerate(sequence)
+                    end = object()
+                    while True:
+                        task = scheduler.take(0) if scheduler.track else scheduler.fresh()
+                        if task is None:
+                            break
+                        index, val = task
+                        if scheduler.track:
+                            scheduler.assign(0, task)
+                        try:
+                            if ship_items:
+                                pass
+                            elif indexable:
+                                try:
+                                    val = sequence[index]
+                                except IndexError:
+                                    val = end
+                            else:
+                                for j, val in items:
+                                    if j == index:
+                                        break
+                                else:
+                                    val = end
+                            if val is not end:
+                                scheduler.serve()
+                                yield from scheduler.collected()
+                                result = func(val)
+                        except Exception:
+                            if not recover:
+                                raise
+                            scheduler.fail(0, traceback.format_exc())
+                            continue
+                        scheduler.assigned.pop(0, None)
+                        if val is end:
+                            break
+                        if speculative and not scheduler.accept(index):
+                            continue
+                        writer.add(index)
+                        yield result
+                        pbar.update()
 
-        try:
-            total = len(sequence)
-        except TypeError:
-            total = None
+                while scheduler.workers > 0:
+                    scheduler.receive()
+                    yield from scheduler.collected()
+            except BaseException:
+                if root_as_worker:
+                    scheduler.cancelled = True
+                    # Discard the results.
+                    scheduler.drain()
+                raise
+
+        # Tasks, that are assigned again, but no worker is left.
+        report = scheduler.report + [task[0] for task in scheduler.pending]
+        attempts = scheduler.attempts
+
+        failed_indices = scheduler.failed
+        if failures is not None:
+            failures.extend([
+                dict(index=index,
+                     ranks=[rank_ for rank_, _ in attempts[index]],
+                     errors=[error for _, error in attempts[index]])
+                for index in report
+            ])
+        else:
+            failed_indices += [
+                (rank_, index) for index in report for rank_, _ in attempts[index]]
 
         # Move this to a separate function and check that all cases are correct
         if total is not None or len(failed_indices) > 0:
-            if len(failed_indices) > 0 or (not total < i):
+            if len(failed_indices) > 0 or scheduler.position < total:
                 failed_indices = '\n'.join([
                     f'worker {rank_} failed for index {index}'
                     for rank_, index in failed_indices
                 ])
                 raise AssertionError(
-                    f'{total}, {i}: Iterator is not consumed.\n'
+                    f'{total}, {scheduler.position}: Iterator is not consumed.\n'
                     f'{failed_indices}'
                 )
 
-        assert workers == 0, workers
+        assert scheduler.workers == 0, scheduler.workers
     else:
         next_index = -1
+
+        def send_error():
+            comm.send((next_index, traceback.format_exc()), dest=0, tag=tags.error)
+
+        def call(val):
+            # With recover, a failure is sent instead of raised.
+            try:
+                result = func(val)
+            except Exception:
+                if not recover:
+                    raise
+                send_error()
+            else:
+                comm.send(result, dest=0, tag=tags.default)
+
         try:
             comm.send(None, dest=0, tag=tags.start)
             next_index = comm.recv(source=0)
-            if indexable:
+            if ship_items:
+                # A task is (index, item), None at the end.
+                task = next_index
+                while task is not None:
+                    next_index, val = task
+                    call(val)
+                    task = comm.recv(source=0)
+            elif indexable:
                 while True:
                     try:
                         val = sequence[next_index]
                     except IndexError:
                         break
-                    result = func(val)
-                    comm.send(result, dest=0, tag=tags.default)
+                    except Exception:
+                        if not recover:
+                            raise
+                        send_error()
+                    else:
+                        call(val)
                     next_index = comm.recv(source=0)
             else:
                 for i, val in enumerate(sequence):
                     if i == next_index:
-                        result = func(val)
-                        comm.send(result, dest=0, tag=tags.default)
+                        call(val)
                         next_index = comm.recv(source=0)
         except BaseException:
             comm.send(next_index, dest=0, tag=tags.failed)
             raise
         else:
             comm.send(None, dest=0, tag=tags.stop)
+
+
+class _TaskScheduler(Scheduler):
+    """
+    The master of map_unordered: Assigns one task (index, item) at a time
+    to a worker and collects the results. Without ship_items, the item is
+    None and the worker gets the index.
+    """
+    def __init__(
+            self,
+            comm,
+            pbar,
+            writer,
+            tags,
+            *,
+            pbar_prefix,
+            retries,
+            recover,
+            requeue,
+            track,
+            speculative,
+            total,
+            completed,
+            iterator,
+    ):
+        # A failed task is assigned again, while retries are left.
+        super().__init__(
+            comm, pbar, pbar_prefix=pbar_prefix, retries=retries,
+            reassign=bool(retries))
+        self.writer = writer
+        self.tags = tags
+        self.recover = recover
+        # Lost workers are detected with the ame backend. Their task is
+        # known, when the tasks are tracked, and is assigned again
+        # (requeue), when the worker does not iterate.
+        self.requeue = requeue and self.detect
+        self.track = track or self.detect
+        self.speculative = speculative
+        self.total = total
+        # With resume: The indices, that are skipped.
+        self.completed = completed
+        # With ship_items: The master is the only one, that iterates.
+        self.iterator = iterator
+        self.exhausted = False
+        # The next index, that is not yet assigned.
+        self.position = 0
+
+        # With speculative: The duplicated indices and those with a result.
+        self.duplicated = set()
+        self.done = set()
+
+        # The results, that are not yet yielded, see collected.
+        self.results = collections.deque()
+
+    def collected(self):
+        while self.results:
+            yield self.results.popleft()
+
+    def fresh(self):
+        # Without length, a worker detects the end with an IndexError.
+        # With resume, the completed indices are skipped.
+        while not self.exhausted:
+            if self.iterator is not None:
+                try:
+                    item = next(self.iterator)
+                except StopIteration:
+                    self.exhausted = True
+                    break
+            elif (self.retries or self.speculative) and self.position >= self.total:
+                self.exhausted = True
+                break
+            else:
+                item = None
+            self.position += 1
+            if self.position - 1 not in self.completed:
+                return self.position - 1, item
+        return None
+
+    def send_task(self, source, task):
+        if task is None:
+            # Behind the end of each sequence (or no item), the worker
+            # stops.
+            self.send(None if self.iterator is not None else sys.maxsize, source)
+            return
+        if self.track:
+            self.assign(source, task)
+        self.send(task if self.iterator is not None else task[0], source)
+
+    def pop(self, source):
+        # The task of the rank, None when it has no task.
+        tasks = self.assigned.pop(source, None)
+        return tasks[0] if tasks else None
+
+    def duplicate(self, source):
+        # With speculative: The task of another rank, that runs the
+        # longest time and is not yet duplicated.
+        if not self.speculative:
+            return None
+        candidates = [
+            rank_ for rank_, tasks in self.assigned.items()
+            if tasks and rank_ != source and tasks[0][0] not in self.duplicated]
+        if not candidates:
+            return None
+        task = self.assigned[min(candidates, key=self.since.get)][0]
+        self.duplicated.add(task[0])
+        return task
+
+    def accept(self, index):
+        # With speculative: Only the first result of a duplicated task.
+        if index not in self.duplicated:
+            return True
+        if index in self.done:
+            return False
+        self.done.add(index)
+        return True
+
+    def fail(self, source, error):
+        task = self.pop(source)
+        if task is None:
+            return
+        if self.attempt(task[0], source, error):
+            self.pending.append(task)
+        else:
+            self.pbar.update()
+
+    def lose(self, source):
+        error = f'Lost rank {source}, e.g. the process was killed.'
+        if self.recover:
+            self.fail(source, error)
+            return
+        task = self.pop(source)
+        if task is None:
+            return
+        if self.requeue:
+            self.attempts[task[0]].append((source, error))
+            self.pending.append(task)
+        else:
+            self.failed.append((source, task[0]))
+            self.pbar.update()
+
+    def handle(self, result):
+        tags = self.tags
+        source, tag = self.status.source, self.status.tag
+        accepted = True
+        if tag == tags.error:
+            _, error = result
+            self.fail(source, error)
+        elif tag in [tags.default, tags.stop] and self.track:
+            # With stop: The index behind the end.
+            task = self.pop(source)
+            if tag == tags.default and self.speculative and task is not None:
+                accepted = self.accept(task[0])
+            if tag == tags.default and accepted and task is not None:
+                self.writer.add(task[0])
+
+        if tag in [tags.default, tags.start, tags.error]:
+            if tag == tags.error:
+                # The failed task goes preferably to a waiting worker.
+                self.release()
+            self.answer(source)
+        if tag == tags.default and accepted:
+            self.results.append(result)
+        if (tag == tags.default and accepted) or (
+                tag == tags.failed and not self.recover):
+            self.pbar.update()
+
+        if tag in [tags.stop, tags.failed]:
+            self.finish(source)
+        if tag == tags.failed:
+            if self.recover:
+                self.fail(source, None)
+            else:
+                last_index = result
+                self.failed.append((source, last_index))
+                self.pop(source)
+            self.unpark(source)
+        if self.track:
+            self.release()
@@ -26,6 +26,11 @@ __all__ = [
     'barrier',
     'bcast',
     'gather',
+    'scatter',
+    'allgather',
+    'reduce',
+    'allreduce',
+    'alltoall',
     'MPI',
     'COMM',
     'call_on_root_and_broadcast',
@@ -108,16 +113,30 @@ if not _mpi_available:
     # support mpi or computers that do not need mpi, e.g. on a development
     # notebook mpi may not be installed.
 
+    def _copy_buffer(self, sendbuf, recvbuf, *args, **kwargs):
+        # With a single process, the buffer collectives copy sendbuf.
+        if sendbuf is not _dummy_MPI.IN_PLACE:
+            recvbuf.reshape(-1)[:] = sendbuf.reshape(-1)
+
     class DUMMY_COMM_WORLD:
         size = 1
         rank = 0
         Barrier = lambda self: None
         bcast = lambda self, data, *args, **kwargs: data
         gather = lambda self, data, *args, **kwargs: [data]
+        scatter = lambda self, data, *args, **kwargs: list(data)[0]
+        allgather = lambda self, data, *args, **kwargs: [data]
+        reduce = lambda self, data, *args, **kwargs: data
+        allreduce = lambda self, data, *args, **kwargs: data
+        alltoall = lambda self, data, *args, **kwargs: list(data)
+        Allreduce = Reduce_scatter = Allgather = _copy_buffer
         Clone = lambda self: self
 
     class _dummy_MPI:
         COMM_WORLD = DUMMY_COMM_WORLD()
+        # With a single process, reduce returns the object, the op is unused.
+        SUM = PROD = MAX = MIN = LAND = LOR = None
+        IN_PLACE = object()
 
     MPI = _dummy_MPI()
 
@@ -175,6 +194,45 @@ def gather(obj, root: int = ROOT):
     return COMM.gather(obj, root=root)
 
 
+def scatter(objs, root: int = ROOT):
+    """
+    Pickles the objs[i] on the root process and sends it to process i.
+    Returns the object for this process.
+    """
+    return COMM.scatter(objs, root=root)
+
+
+def allgather(obj):
+    """
+    Like gather, but each process gets the list of all objects.
+    """
+    return COMM.allgather(obj)
+
+
+def reduce(obj, op=MPI.SUM, root: int = ROOT):
+    """
+    Combines the obj of all processes with op (e.g. MPI.SUM, MPI.MAX or a
+    function, that combines two objects) and returns the result on the
+    root process. The other processes get None.
+    """
+    return COMM.reduce(obj, op=op, root=root)
+
+
+def allreduce(obj, op=MPI.SUM):
+    """
+    Like reduce, but each process gets the result.
+    """
+    return COMM.allreduce(obj, op=op)
+
+
+def alltoall(objs):
+    """
+    Each process sends objs[i] to process i. Returns the list of the objects,
+    that were sent to this process.
+    """
+    return COMM.alltoall(objs)
+
+
 def call_on_root_and_broadcast(func, *args, **kwargs):
     if IS_MASTER:
         result = func(*args, **kwargs)
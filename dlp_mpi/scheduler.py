@@ -0,0 +1,201 @@
+import collections
+import time
+
+from dlp_mpi import MPI
+
+
+__all__ = [
+    'Scheduler',
+]
+
+
+# Raised by a communicator, that reports failed (e.g. killed) processes,
+# see Ack_failed. Only the ame backend reports them, with mpi4py a killed
+# process aborts the job.
+_ProcFailed = getattr(MPI, 'ProcFailed', ())
+
+
+class Scheduler:
+    """
+    The master side of split_managed and map_unordered: Answers the
+    requests of the workers with tasks and tracks the tasks, that are in
+    flight, that failed and that have to be assigned again.
+
+    A task is a sequence, whose first entry is an index, e.g. split_managed
+    assigns chunks [start, stop] and map_unordered (index, item).
+    A subclass implements
+        fresh: The next new task, None at the end,
+        send_task: Sends a task (None: the end) to a worker,
+        handle: Handles the message of a worker (the tag is in status),
+        lose: Handles a lost worker (ame backend),
+    and optionally duplicate (straggler mitigation).
+
+    Attributes:
+        assigned: The tasks of each rank, that are not yet processed.
+        pending: The tasks, that are assigned again (e.g. of a lost worker).
+        parked: The workers, whose request waits for a task, because a
+            failure may assign a task again, see release.
+        attempts: The (rank, error) of the failed attempts of each index.
+        report: The indices, that failed too often.
+        failed: The (rank, index) of the failures, that are not assigned
+            again.
+        finished: The workers, that sent stop or failed, or are lost.
+        since: The time, when each rank got its last task.
+        detect: Whether lost workers are reported (ame backend).
+        cancelled: The master failed (root_as_worker), stop the workers.
+    """
+    def __init__(self, comm, pbar, *, pbar_prefix=None, retries=0, reassign=False):
+        self.comm = comm
+        self.status = MPI.Status()
+        self.pbar = pbar
+        if pbar_prefix is None:
+            self.pbar_prefix = ''
+        else:
+            self.pbar_prefix = f'{pbar_prefix}, '
+        self.retries = retries
+        # Whether a failure assigns its task again, i.e. the idle workers
+        # wait, while tasks are in flight.
+        self.reassign = reassign
+
+        self.workers = comm.size - 1
+        self.cancelled = False
+        self.assigned = collections.defaultdict(collections.deque)
+        self.pending = collections.deque()
+        self.parked = collections.deque()
+        self.attempts = collections.defaultdict(list)
+        self.report = []
+        self.failed = []
+        self.finished = set()
+        self.since = {}
+
+        # Whether lost workers are reported, see lost.
+        self.detect = bool(_ProcFailed)
+        if self.detect:
+            comm.Ack_failed(0)
+        self.pbar.set_description(f'{self.pbar_prefix}busy: {self.workers}')
+
+    def fresh(self):
+        raise NotImplementedError()
+
+    def send_task(self, source, task):
+        raise NotImplementedError()
+
+    def handle(self, obj):
+        raise NotImplementedError()
+
+    def lose(self, source):
+        raise NotImplementedError()
+
+    def duplicate(self, source):
+        return None
+
+    def send(self, obj, dest, tag=0):
+        # A lost worker is handled, when a receive reports it, see lost.
+        try:
+            self.comm.send(obj, dest=dest, tag=tag)
+        except _ProcFailed:
+            pass
+
+    def in_flight(self):
+        return any(self.assigned.values())
+
+    def assign(self, source, task):
+        self.assigned[source].append(task)
+        self.since[source] = time.perf_counter()
+
+    def take(self, source):
+        # A failed task goes to another rank. Only when no other rank
+        # works, it is assigned to the same rank again.
+        for task in self.pending:
+            if all(rank != source for rank, _ in self.attempts[task[0]]):
+                self.pending.remove(task)
+                return task
+        task = self.fresh()
+        if task is None and self.pending and not self.in_flight():
+            task = self.pending.popleft()
+        return task
+
+    def answer(self, source):
+        task = None
+        if not self.cancelled:
+            task = self.take(source)
+            if task is None:
+                task = self.duplicate(source)
+            if task is None and self.reassign and self.in_flight():
+                self.parked.append(source)
+                return
+        self.send_task(source, task)
+
+    def release(self):
+        # Answer the parked requests, see answer.
+        while self.parked:
+            source = self.parked.popleft()
+            self.answer(source)
+            if self.parked and self.parked[-1] == source:
+                # Parked again, i.e. the remaining requests wait too.
+                self.parked.rotate()
+                break
+
+    def unpark(self, source):
+        while source in self.parked:
+            self.parked.remove(source)
+
+    def attempt(self, index, source, error=None):
+        """
+        Record a failed attempt, returns whether the index may be assigned
+        again, i.e. it failed at most retries times.
+        """
+        self.attempts[index].append((source, error))
+        if len(self.attempts[index]) > self.retries:
+            self.report.append(index)
+            return False
+        return True
+
+    def finish(self, source):
+        self.finished.add(source)
+        self.workers -= 1
+        self.pbar.set_description(f'{self.pbar_prefix}busy: {self.workers}')
+
+    def lost(self):
+        # Workers, that died without a stop or failed message (e.g. a
+        # killed process).
+        for source in self.comm.Get_failed():
+            if source in self.finished:
+                continue
+            self.finish(source)
+            self.lose(source)
+            self.unpark(source)
+        self.comm.Ack_failed()
+        self.release()
+
+    def receive(self):
+        # Wait for the next message and handle it.
+        self.release()
+        try:
+            obj = self.comm.recv(
+                source=MPI.ANY_SOURCE,
+                tag=MPI.ANY_TAG,
+                status=self.status,
+            )
+        except _ProcFailed:
+            self.lost()
+        else:
+            self.handle(obj)
+
+    def serve(self):
+        # Answer the requests, that already arrived.
+        while self.workers > 0:
+            try:
+                if not self.comm.iprobe(
+                        source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=self.status):
+                    break
+            except _ProcFailed:
+                self.lost()
+                continue
+            self.handle(self.comm.recv(
+                source=self.status.source, tag=self.status.tag, status=self.status))
+
+    def drain(self):
+        # Handle the messages, until all workers finished.
+        while self.workers > 0:
+            self.receive()
@@ -1,2 +1,3 @@
 from .round_robin import *
 from .managed import *
+from .shared_counter import *
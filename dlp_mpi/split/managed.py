@@ -1,8 +1,12 @@
+import collections
+import itertools
+import sys
 from enum import IntEnum, auto
 
 import dlp_mpi
 from dlp_mpi import MPI, COMM
 from dlp_mpi.mpi import RankInt
+from dlp_mpi.scheduler import Scheduler
 
 
 __all__ = [
@@ -14,6 +18,7 @@ class _tags(IntEnum):
 
     # The first time the worker requests a task, this tag is sent:
     #    need new data
+    # With prefetch, the worker sends it multiple times.
     start = auto()
 
     # The last time the worker requests a task, this tag is sent:
@@ -33,6 +38,125 @@ class _tags(IntEnum):
     # In the moment disabled.
     data = auto()
 
+    # With speculative: The master tells a worker, that another worker
+    # already processed an index of its chunks.
+    cancel = auto()
+
+
+def _next_chunk(start, length, workers, schedule, chunk_size):
+    """
+    The stop index of the next chunk, that the root assigns to a worker.
+
+    dynamic: Each chunk has chunk_size indices.
+    guided: Each chunk has 1 / (2 * workers) of the remaining indices, but
+        at least chunk_size (factoring, i.e. each round of chunks processes
+        half of the remaining work). Large chunks in the beginning reduce
+        the communication, small chunks in the end balance the load.
+
+    >>> [_next_chunk(0, 100, 2, 'dynamic', 1), _next_chunk(98, 100, 2, 'dynamic', 5)]
+    [1, 100]
+    >>> start, chunks = 0, []
+    >>> while start < 100:
+    ...     stop = _next_chunk(start, 100, 2, 'guided', 2)
+    ...     chunks.append(stop - start)
+    ...     start = stop
+    >>> chunks
+    [25, 18, 14, 10, 8, 6, 4, 3, 3, 2, 2, 2, 2, 1]
+    >>> _next_chunk(100, 100, 2, 'guided', 2)  # The end, i.e. the worker stops
+    101
+    """
+    if schedule == 'guided' and length is not None:
+        chunk_size = max(chunk_size, (length - start) // (2 * workers))
+    elif schedule not in ['dynamic', 'guided']:
+        raise ValueError(schedule)
+    if length is None:
+        return start + chunk_size
+    if start >= length:
+        return start + 1
+    return min(start + chunk_size, length)
+
+
+class _Reordered:
+    """
+    The items of an indexable sequence in the order of the indices in
+    order, e.g. the most expensive first.
+
+    >>> reordered = _Reordered('abc', [2, 0, 1])
+    >>> len(reordered), reordered[0], list(reordered)
+    (3, 'c', ['c', 'a', 'b'])
+    """
+    def __init__(self, sequence, order):
+        self.sequence = sequence
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, position):
+        return self.sequence[self.order[position]]
+
+
+def _journaled(sequence, journal, resume, progress_bar):
+    """
+    The items of the sequence without a master (single process), that are
+    not in the journal. An item is recorded, when the loop body returns.
+    """
+    completed = dlp_mpi.util.Journal.load(journal) if resume else set()
+    with dlp_mpi.util.Journal(journal, resume) as writer:
+        items = ((index, item) for index, item in enumerate(sequence)
+                 if index not in completed)
+        if progress_bar:
+            from tqdm import tqdm
+            items = tqdm(items, mininterval=2)
+        for index, item in items:
+            yield item
+            writer.add(index)
+
+
+class _BackgroundLoader:
+    """
+    Loads the items of an indexable sequence in a thread pool, while the
+    loop body processes the current item. At most 2 * threads items are
+    loaded in advance.
+
+    >>> loader = _BackgroundLoader([10, 11, 12, 13], threads=1)
+    >>> loader.schedule(iter([1, 2, 3]))
+    >>> sorted(loader.futures)
+    [1, 2]
+    >>> loader.get(1), loader.get(2), loader.get(0)
+    (11, 12, 10)
+    >>> loader.close()
+    """
+    def __init__(self, sequence, threads):
+        import concurrent.futures
+        self.sequence = sequence
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            threads, thread_name_prefix='split_managed_loader')
+        self.depth = 2 * threads
+        self.futures = {}
+
+    def schedule(self, indices):
+        """
+        Start to load the next indices, the current index is the first.
+        """
+        for index in itertools.islice(indices, self.depth):
+            if len(self.futures) >= self.depth:
+                break
+            if index not in self.futures:
+                self.futures[index] = self.executor.submit(
+                    self.sequence.__getitem__, index)
+
+    def get(self, index):
+        future = self.futures.pop(index, None)
+        if future is None:
+            return self.sequence[index]
+        return future.result()
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown(wait=True)
+
 
 def split_managed(
         sequence,
@@ -43,11 +167,24 @@ def split_managed(
         pbar_prefix=None,
         root=dlp_mpi.MASTER,
         comm=None,
+        schedule='dynamic',
+        chunk_size=1,
+        prefetch=0,
+        load_threads=0,
+        root_as_worker=False,
+        ship_items=False,
+        cost=None,
+        retries=0,
+        failures=None,
+        speculative=False,
+        journal=None,
+        resume=False,
         # gather_mode=False,
 ):
     """
     A master process pushes tasks to the workers.
-    Requires at least 2 mpi processes, but to gain a speedup 3 are needed.
+    Requires at least 2 mpi processes, but to gain a speedup 3 are needed
+    (or 2 with root_as_worker).
 
     Parallel: Body of the for loop.
     Communication: Indices
@@ -66,12 +203,98 @@ def split_managed(
               robin selection.
         False: Use getitem instead of iterating over the iterator.
 
+    ship_items:
+        Only the master iterates over the sequence and sends the items of a
+        chunk to the worker, i.e. the items have to be picklable. Without
+        it, each worker iterates over the whole sequence (or uses getitem).
+        Use it for generators, that cannot be iterated multiple times or
+        read files, or when only the master can access the data.
+
+    schedule, chunk_size:
+        How many indices the master assigns to a worker at once, see
+        _next_chunk. 'dynamic' assigns chunk_size indices, 'guided' starts
+        with large chunks and shrinks them to chunk_size towards the end.
+        The default assigns one index at a time. With many short examples
+        the master becomes the bottleneck, then use larger chunks.
+        'guided' requires the length of the sequence, otherwise it falls
+        back to 'dynamic'.
+
+    prefetch:
+        The number of chunks, that a worker requests in advance. Without
+        prefetch, a worker waits after each chunk a round trip to the
+        master for the next index. With prefetch, the next indices are
+        already received, when the loop body finishes.
+
+    load_threads:
+        The number of threads, that load the next items (sequence[index])
+        of the worker, while the loop body processes the current item.
+        Useful, when the getitem is expensive, e.g. reading audio files.
+        Only for indexable sequences. The prefetch is at least 2: The
+        answer to a request, that is sent after a chunk, arrives while the
+        next chunk is processed, i.e. it can be loaded in the background
+        while the chunk after the next is processed.
+
+    cost:
+        The cost of each item, either a sequence with one value per index
+        or a callable, that gets an item. The master assigns the most
+        expensive items first, so an expensive item does not delay the end,
+        when the other workers are already done. The progress bar shows
+        the processed cost instead of the number of items. The master
+        evaluates the costs and broadcasts the order, hence a precomputed
+        sequence is cheaper, when getitem is expensive. Only for indexable
+        sequences.
+
+    retries, failures:
+        When the loop body fails on a worker, the worker stops (the
+        exception leaves the for loop) and, by default, the master raises
+        an AssertionError at the end. With retries or a failures list, the
+        master assigns the failed index up to retries times to other
+        workers and the unprocessed indices of the failed worker to the
+        remaining workers, i.e. the loop continues with fewer workers.
+        Idle workers wait until no failure is possible anymore. Indices,
+        that failed retries + 1 times, are appended to failures as
+        dict(index=..., ranks=[...]) (the ranks, that failed) instead of
+        raising an AssertionError. Only for indexable sequences without
+        ship_items.
+
+        With the ame backend, the master also detects workers, that die
+        without an exception (e.g. a killed process) and assigns their
+        unprocessed chunks to the remaining workers (with the defaults,
+        only to workers, that have not yet stopped). With `retries > 0` or
+        `failures=...`, the first index of the chunk, that the dead worker
+        was processing, counts as a failed attempt. Lost chunks of
+        ship_items or not indexable sequences are reported as failed.
+
+    speculative:
+        Straggler mitigation at the end: When all indices are assigned, an
+        idle worker gets a duplicate of an unprocessed index of the worker,
+        that works the longest time on its current chunk (from the back of
+        its chunks). The first processed copy counts, the other worker
+        skips the index, if it has not yet started it. Hence the loop body
+        may run twice for an index, i.e. it has to be idempotent (e.g.
+        overwrite its output file). Useful, when a slow node holds the last
+        chunks, e.g. with prefetch or chunk_size. Only for indexable
+        sequences without ship_items and load_threads, and not with
+        `retries > 0` or `failures=...`.
+
+    journal, resume:
+        A file, where the master appends the indices, that are processed
+        (checkpoint, see dlp_mpi.util.Journal). With resume, the indices
+        in the journal are skipped, e.g. when the job was killed, because
+        of the walltime, the restarted script processes only the
+        remaining indices. Without resume, the journal is cleared. Resume
+        needs an indexable sequence without ship_items, the sequence has
+        to be the same.
+
+    root_as_worker:
+        The master also processes chunks. Between two of its items, it
+        answers the requests of the workers, hence a long loop body on the
+        master delays the workers, use prefetch or chunks to hide it.
+        When the loop body fails on the master (or breaks), the remaining
+        workers are stopped.
+
 
     ToDo:
-        - Make a more efficient scheduling
-          - allow indexable
-          - Use round robin in the beginning and for the last task this
-            scheduler. Or submit chunks of work.
         - When a slave throw a exception, the task is currently ignored.
           Change it that the execution get canceled.
 
@@ -94,14 +317,16 @@ def split_managed(
     size = comm.size
 
     if allow_single_worker and size == 1:
-        if not progress_bar:
+        if journal is not None:
+            yield from _journaled(sequence, journal, resume, progress_bar)
+        elif not progress_bar:
             yield from sequence
         else:
             from tqdm import tqdm
             yield from tqdm(sequence, mininterval=2)
         return
 
-    if size <= 1:
+    if size <= 1 and not root_as_worker:
         raise ValueError(
             'When you want to allow a single worker for split_managed,\n'
             'set allow_single_worker to True. i.e.:\n'
@@ -109,107 +334,513 @@ def split_managed(
             f'Got: size={size}'
         )
 
-    assert size > 1, (size)
     assert root < size, (root, size)
     assert root == 0, root
 
-    status = MPI.Status()
-    workers = size - 1
+    assert not load_threads or is_indexable, (load_threads, is_indexable)
+    assert not (load_threads and ship_items), (load_threads, ship_items)
+    if load_threads:
+        prefetch = max(prefetch, 2)
+
+    # Recover from failed workers, i.e. assign their indices again.
+    recover = retries > 0 or failures is not None
+    if recover:
+        assert is_indexable and not ship_items, (is_indexable, ship_items)
+    if speculative:
+        assert is_indexable and not (ship_items or load_threads or recover), (
+            is_indexable, ship_items, load_threads, recover)
+
+    # With cost or resume: The index of each position, i.e. without the
+    # completed indices and the most expensive first.
+    # With cost: The cumulative cost of the reordered items, i.e. the
+    # cost of the positions [start, stop) is
+    # cumulative[stop] - cumulative[start].
+    order = None
+    cumulative = None
+    assert journal is not None or not resume, (journal, resume)
+    if cost is not None or resume:
+        assert is_indexable and not ship_items, (is_indexable, ship_items)
+        if rank == root:
+            order = range(len(sequence))
+            if resume:
+                completed = dlp_mpi.util.Journal.load(journal)
+                order = [index for index in order if index not in completed]
+            if cost is not None:
+                if callable(cost):
+                    cost = {index: cost(sequence[index]) for index in order}
+                else:
+                    assert len(cost) == len(sequence), (len(cost), len(sequence))
+                # Stable, i.e. items with the same cost keep their order.
+                order = sorted(order, key=cost.__getitem__, reverse=True)
+                cumulative = list(itertools.accumulate(
+                    [cost[index] for index in order], initial=0))
+            order = list(order)
+        order = comm.bcast(order, root=root)
+        sequence = _Reordered(sequence, order)
+
+    # The number of ranks, that process chunks (guided schedule).
+    processing = size if root_as_worker else size - 1
 
     # ToDo: Ignore workers that failed before this function is called.
     # registered_workers = set()
 
     # dlp_mpi.barrier()
 
-    failed_indices = []
-
-    if rank == root:
-        i = 0
-
-        if pbar_prefix is None:
-            pbar_prefix = ''
-        else:
-            pbar_prefix = f'{pbar_prefix}, '
-
-        with dlp_mpi.util.progress_bar(
-                sequence=sequence,
-                display_progress_bar=progress_bar,
-        ) as pbar:
-            pbar.set_description(f'{pbar_prefix}busy: {workers}')
-            while workers > 0:
-                last_index = comm.recv(
-                    source=MPI.ANY_SOURCE,
-                    tag=MPI.ANY_TAG,
-                    status=status,
-                )
-
-                if status.tag in [_tags.default, _tags.start]:
-                    comm.send(i, dest=status.source)
-                    i += 1
-
-                if status.tag in [_tags.default, _tags.failed]:
-                    pbar.update()
-
-                if status.tag in [_tags.stop, _tags.failed]:
-                    workers -= 1
-                    if progress_bar:
-                        pbar.set_description(f'{pbar_prefix}busy: {workers}')
-
-                if status.tag == _tags.failed:
-                    failed_indices += [(status.source, last_index)]
-
-        assert workers == 0, workers
+    if rank != root:
+        yield from _worker(
+            sequence,
+            comm=comm,
+            root=root,
+            is_indexable=is_indexable,
+            ship_items=ship_items,
+            prefetch=prefetch,
+            load_threads=load_threads,
+            speculative=speculative,
+        )
+        return
 
+    try:
+        length = len(sequence)
+    except TypeError:
+        length = None
+
+    with dlp_mpi.util.progress_bar(
+            sequence=sequence,
+            display_progress_bar=progress_bar,
+            total=None if cumulative is None else cumulative[-1],
+    ) as pbar, dlp_mpi.util.Journal(journal, resume) as writer:
+        scheduler = _ChunkScheduler(
+            comm,
+            pbar,
+            writer,
+            pbar_prefix=pbar_prefix,
+            retries=retries,
+            recover=recover,
+            # Assign the chunks of lost workers again (ame backend).
+            requeue=is_indexable and not ship_items,
+            length=length,
+            iterator=iter(sequence) if ship_items else None,
+            order=order,
+            cumulative=cumulative,
+            schedule=schedule,
+            chunk_size=chunk_size,
+            processing=processing,
+            speculative=speculative,
+        )
         try:
-            length = len(sequence)
-        except TypeError:
-            length = None
+            if root_as_worker:
+                for index, val in scheduler.root_items(sequence, is_indexable):
+                    scheduler.serve()
+                    assert val is not None, val
+                    data = yield val
+                    assert data is None, data
+                    pbar.update(scheduler.record(root, index, index + 1))
+        except BaseException:
+            scheduler.cancelled = True
+            raise
+        finally:
+            scheduler.drain()
 
-        # i is bigger than len(iterator), because the slave says value is to big
-        # and than the master increases the value
-        if length is not None:
-            if (not length < i) or len(failed_indices) > 0:
-                failed_indices = '\n'.join([
-                    f'worker {rank_} failed for index {index}'
-                    for rank_, index in failed_indices
-                ])
-                raise AssertionError(
-                    f'{length}, {i}: Iterator is not consumed.\n'
-                    f'{failed_indices}'
-                )
+    assert scheduler.workers == 0, scheduler.workers
+
+    failed_indices = scheduler.failed
+    if failures is not None:
+        failures.extend([
+            dict(index=scheduler.index(index),
+                 ranks=[rank_ for rank_, _ in scheduler.attempts[index]])
+            for index in scheduler.report
+        ])
     else:
-        next_index = -1
-        successful = False
-        try:
-            comm.send(None, dest=root, tag=_tags.start)
-            next_index = comm.recv(source=root)
+        failed_indices += [
+            (rank_, index)
+            for index in scheduler.report
+            for rank_, _ in scheduler.attempts[index]
+        ]
+
+    # The position is smaller than the length, when all workers stopped,
+    # before all chunks are assigned, e.g. they failed.
+    if length is not None:
+        pending = scheduler.pending
+        if scheduler.position < length or len(failed_indices) > 0 or pending:
+            failed_indices = '\n'.join([
+                f'worker {rank_} failed for index {scheduler.index(index)}'
+                for rank_, index in failed_indices
+            ])
+            if pending:
+                # No worker was left for the chunks of lost workers.
+                failed_indices += '\nnot processed indices: ' + ', '.join([
+                    str(scheduler.index(index))
+                    for start, stop in pending for index in range(start, stop)
+                ])
+            raise AssertionError(
+                f'{length}, {scheduler.position}: Iterator is not consumed.\n'
+                f'{failed_indices}'
+            )
 
-            if not is_indexable:
-                for i, val in enumerate(sequence):
-                    if i == next_index:
-                        assert val is not None, val
-                        data = yield val
-                        assert data is None, data
-                        comm.send(next_index, dest=root, tag=_tags.default)
-                        next_index = comm.recv(source=root)
+
+class _ChunkScheduler(Scheduler):
+    """
+    The master of split_managed: Assigns chunks [start, stop] of positions
+    to the workers (see _next_chunk) and records the processed positions.
+    A position is an index of the sequence, with cost or resume an index
+    of the reordered sequence (see index).
+    """
+    def __init__(
+            self,
+            comm,
+            pbar,
+            writer,
+            *,
+            pbar_prefix,
+            retries,
+            recover,
+            requeue,
+            length,
+            iterator,
+            order,
+            cumulative,
+            schedule,
+            chunk_size,
+            processing,
+            speculative,
+    ):
+        # With recover, the failed worker stops and its unprocessed chunks
+        # are assigned again.
+        super().__init__(
+            comm, pbar, pbar_prefix=pbar_prefix, retries=retries,
+            reassign=recover)
+        self.writer = writer
+        self.requeue = requeue
+        self.length = length
+        # With ship_items: The master is the only one, that iterates.
+        self.iterator = iterator
+        self.order = order
+        # With cost: The cumulative cost of the positions, see weight.
+        self.cumulative = cumulative
+        self.schedule = schedule
+        self.chunk_size = chunk_size
+        self.processing = processing
+        # The next position, that is not yet assigned.
+        self.position = 0
+
+        # With speculative: The processed positions, the two workers of
+        # each duplicated position and the workers, that got the end.
+        self.done = bytearray(length) if speculative else None
+        self.stolen = {}
+        self.ended = set()
+
+    def index(self, position):
+        return position if self.order is None else self.order[position]
+
+    def weight(self, start, stop):
+        if self.cumulative is None:
+            return stop - start
+        return self.cumulative[stop] - self.cumulative[start]
+
+    def fresh(self):
+        # The next chunk, with ship_items [start, stop, items].
+        start = self.position
+        if self.length is not None and start >= self.length:
+            return None
+        stop = _next_chunk(
+            start, self.length, self.processing, self.schedule, self.chunk_size)
+        if self.iterator is None:
+            self.position = stop
+            return [start, stop]
+        items = list(itertools.islice(self.iterator, stop - start))
+        if not items:
+            return None
+        self.position = start + len(items)
+        return [start, self.position, items]
+
+    def send_task(self, source, task):
+        if task is None:
+            # Behind the end of the sequence (or no items), the worker
+            # stops.
+            self.ended.add(source)
+            if self.iterator is None:
+                self.send(sys.maxsize, source)
             else:
-                length = len(sequence)
-                assert length is not None, length
+                self.send((self.position, []), source)
+            return
+        start, stop = task[:2]
+        self.assign(source, [start, stop])
+        if self.iterator is not None:
+            self.send((start, task[2]), source)
+        else:
+            # A single index is sent as int, see the worker.
+            self.send(start if stop == start + 1 else (start, stop), source)
+
+    def duplicate(self, source):
+        # With speculative: Duplicate the last unprocessed position of the
+        # worker, that works the longest time on its current chunk.
+        # The worker processes its chunks from the front.
+        if self.done is None or source in self.ended:
+            return None
+        for victim in sorted(self.since, key=self.since.get):
+            if victim == source:
+                continue
+            for start, stop in reversed(self.assigned[victim]):
+                for index in reversed(range(start, min(stop, self.length))):
+                    if not self.done[index] and index not in self.stolen:
+                        self.stolen[index] = (victim, source)
+                        return [index, index + 1]
+        return None
+
+    def record(self, source, start, stop, count_only=False):
+        # The weight of the processed positions [start, stop), that are
+        # recorded in the journal. With speculative, only the first copy
+        # of a position counts and the other worker skips it. With
+        # count_only, the positions are not recorded, e.g. a failed index.
+        if count_only:
+            return self.weight(start, stop)
+        if self.done is None:
+            if self.writer.file is not None:
+                self.writer.extend(map(self.index, range(start, stop)))
+            return self.weight(start, stop)
+        count = 0
+        for index in range(start, min(stop, self.length)):
+            if self.done[index]:
+                continue
+            self.done[index] = 1
+            self.writer.add(self.index(index))
+            count += self.weight(index, index + 1)
+            for other in self.stolen.pop(index, ()):
+                if other != source and other not in self.ended and any(
+                        a <= index < b for a, b in self.assigned[other]):
+                    self.send(index, other, tag=_tags.cancel)
+        return count
+
+    def processed(self, source, last_index, count_only=False):
+        # The weight of the positions, that the worker processed, when its
+        # last processed (or failed) position is last_index.
+        chunks = self.assigned[source]
+        count = 0
+        while chunks and chunks[0][0] <= last_index:
+            start, stop = chunks[0]
+            if last_index + 1 < stop:
+                chunks[0][0] = last_index + 1
+                return count + self.record(source, start, last_index + 1, count_only)
+            count += self.record(source, start, stop, count_only)
+            chunks.popleft()
+        return count
+
+    def requeue_chunks(self, source):
+        # Assign the unprocessed chunks of the worker again, at most
+        # chunk_size positions at once.
+        for start, stop in self.assigned.pop(source, ()):
+            self.pending.extend([
+                [position, min(position + self.chunk_size, stop)]
+                for position in range(start, stop, self.chunk_size)
+            ])
+
+    def fail(self, source, last_index):
+        # The worker stopped, assign its unprocessed chunks again. The
+        # failed position is the first of them.
+        count = self.processed(source, last_index - 1)
+        chunks = self.assigned[source]
+        if chunks and chunks[0][0] == last_index:
+            if not self.attempt(last_index, source):
+                count += self.processed(source, last_index, count_only=True)
+        if count:
+            self.pbar.update(count)
+        self.requeue_chunks(source)
+        # The requests of the worker are answered before it stops, see
+        # the worker.
+        while source in self.parked:
+            self.parked.remove(source)
+            self.send_task(source, None)
+
+    def lose(self, source):
+        chunks = self.assigned[source]
+        if self.reassign:
+            # The first unprocessed position counts as attempt.
+            self.fail(source, chunks[0][0] if chunks else -1)
+        elif self.requeue:
+            self.requeue_chunks(source)
+        else:
+            self.failed += [(source, start) for start, _ in chunks]
+            self.assigned.pop(source)
+
+    def handle(self, last_index):
+        source, tag = self.status.source, self.status.tag
+        if tag == _tags.failed and self.reassign:
+            self.fail(source, last_index)
+        elif tag in [_tags.default, _tags.stop]:
+            count = self.processed(source, last_index)
+            if count:
+                self.pbar.update(count)
+        elif tag == _tags.failed:
+            # The failed position counts, but is not recorded.
+            count = self.processed(source, last_index - 1) + self.processed(
+                source, last_index, count_only=True)
+            if count:
+                self.pbar.update(count)
+            self.failed.append((source, last_index))
+
+        if tag in [_tags.default, _tags.start]:
+            self.answer(source)
+        if tag in [_tags.stop, _tags.failed]:
+            self.finish(source)
+        self.release()
+
+    def root_items(self, sequence, is_indexable):
+        # With root_as_worker: The items of the chunks, that the master
+        # assigns itself.
+        items = enumerate(sequence)
+        while True:
+            task = self.fresh()
+            if task is None:
+                return
+            if self.iterator is not None:
+                yield from enumerate(task[2], task[0])
+                continue
+            for index in range(*task):
+                if is_indexable:
+                    yield index, sequence[index]
+                    continue
+                for j, val in items:
+                    if j == index:
+                        yield index, val
+                        break
+                else:
+                    return
+
+
+def _worker(
+        sequence,
+        *,
+        comm,
+        root,
+        is_indexable,
+        ship_items,
+        prefetch,
+        load_threads,
+        speculative,
+):
+    """
+    The worker side of split_managed: Requests chunks from the master and
+    yields their items.
+    """
+    status = MPI.Status()
 
-                while next_index < length:
-                    val = sequence[next_index]
+    # The number of requests, that the master has not yet answered.
+    outstanding = 0
+    # With load_threads: The posted receives for the requests and the
+    # chunks, that are received before they are processed.
+    posted = collections.deque()
+    received = collections.deque()
+    loader = None
+
+    def request(index, tag):
+        nonlocal outstanding
+        comm.send(index, dest=root, tag=tag)
+        outstanding += 1
+        if loader is not None:
+            posted.append(comm.irecv(source=root))
+
+    def as_chunk(chunk):
+        nonlocal outstanding
+        outstanding -= 1
+        if isinstance(chunk, int):
+            return chunk, chunk + 1
+        return chunk
+
+    # With speculative: The indices, that another worker processed.
+    skip = set()
+
+    def recv_chunk():
+        if posted:
+            return as_chunk(posted.popleft().wait())
+        if not speculative:
+            return as_chunk(comm.recv(source=root))
+        while True:
+            chunk = comm.recv(source=root, status=status)
+            if status.tag != _tags.cancel:
+                return as_chunk(chunk)
+            skip.add(chunk)
+
+    def poll_chunks():
+        # Receive the prefetched chunks, that already arrived, without
+        # waiting for the master. A posted receive (instead of iprobe)
+        # lets the MPI implementation make progress.
+        while posted:
+            done, chunk = posted[0].test()
+            if not done:
+                break
+            posted.popleft()
+            received.append(as_chunk(chunk))
+
+    # The index, that is processed, i.e. the last index, when the
+    # worker reports to the master.
+    next_index = -1
+    successful = False
+    try:
+        if load_threads:
+            loader = _BackgroundLoader(sequence, load_threads)
+        for _ in range(prefetch + 1):
+            request(None, _tags.start)
+        chunk = recv_chunk()
+
+        if ship_items:
+            start, items = chunk
+            while items:
+                for next_index, val in enumerate(items, start):
                     assert val is not None, val
                     data = yield val
                     assert data is None, data
-                    comm.send(next_index, dest=root, tag=_tags.default)
-                    next_index = comm.recv(source=root)
-
-            successful = True
-        finally:
-            if successful:
-                comm.send(next_index, dest=root, tag=_tags.stop)
-            else:
-                comm.send(next_index, dest=root, tag=_tags.failed)
+                request(next_index, _tags.default)
+                start, items = recv_chunk()
+        elif not is_indexable:
+            start, stop = chunk
+            for i, val in enumerate(sequence):
+                if start <= i < stop:
+                    next_index = i
+                    assert val is not None, val
+                    data = yield val
+                    assert data is None, data
+                    if i + 1 == stop:
+                        request(next_index, _tags.default)
+                        start, stop = recv_chunk()
+        else:
+            start, stop = chunk
+            length = len(sequence)
+            assert length is not None, length
+
+            while start < length:
+                for next_index in range(start, min(stop, length)):
+                    if speculative:
+                        while comm.iprobe(source=root, tag=_tags.cancel):
+                            skip.add(comm.recv(source=root, tag=_tags.cancel))
+                        if next_index in skip:
+                            continue
+                    if loader is not None:
+                        poll_chunks()
+                        loader.schedule(itertools.chain(
+                            range(next_index, min(stop, length)),
+                            *[range(a, min(b, length)) for a, b in received]))
+                        val = loader.get(next_index)
+                    else:
+                        val = sequence[next_index]
+                    assert val is not None, val
+                    data = yield val
+                    assert data is None, data
+                request(next_index, _tags.default)
+                start, stop = received.popleft() if received else recv_chunk()
+
+        successful = True
+    finally:
+        if loader is not None:
+            loader.close()
+        if successful:
+            comm.send(next_index, dest=root, tag=_tags.stop)
+        else:
+            comm.send(next_index, dest=root, tag=_tags.failed)
+        # Receive the answers to the remaining requests, they are behind
+        # the end or the worker stops, e.g. a failure. The master
+        # answers all requests, before it handles the stop or failure.
+        while outstanding:
+            recv_chunk()
 
 '''
 def split_managed_(
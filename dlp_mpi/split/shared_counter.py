@@ -0,0 +1,127 @@
+import collections
+import itertools
+from array import array
+
+import dlp_mpi
+from dlp_mpi import MPI, COMM
+
+
+__all__ = [
+    'split_shared_counter',
+]
+
+
+def split_shared_counter(
+        sequence,
+        *,
+        is_indexable=True,
+        progress_bar=False,
+        root=dlp_mpi.MASTER,
+        comm=None,
+        chunk_size=1,
+):
+    """
+    Splits the work between all processes without a master: Each process
+    claims the next chunk_size indices with an atomic fetch-and-add on a
+    counter in the memory of the root (MPI one-sided communication). So
+    all processes work, no process is busy with the scheduling and the
+    scheduling scales with the number of processes.
+
+    Use this instead of split_managed, when the tasks are so short, that a
+    single master cannot keep up with the requests of the workers. Unlike
+    split_round_robin, the work is balanced, when the tasks have different
+    durations.
+
+    With the ame backend, a thread of the root serves the fetch-and-add
+    requests, hence a larger chunk_size reduces the load on the root.
+
+    Args:
+        sequence: The items to process.
+        is_indexable: If False, each process iterates over the sequence
+            and skips the items, that other processes claimed.
+        progress_bar: Display the progress of the counter on the root,
+            i.e. the claimed items of all processes.
+        root: The rank, that has the counter.
+        comm: The communicator. Default: dlp_mpi.COMM
+        chunk_size: The number of indices, that a process claims at once.
+
+    >> assert dlp_mpi.SIZE == 2  # mpi size is 2
+    >> items = list(split_shared_counter(range(5)))
+    >> sorted(itertools.chain(*dlp_mpi.gather(items)))  # on the root
+    [0, 1, 2, 3, 4]
+
+    """
+    if comm is None:
+        comm = COMM
+
+    try:
+        length = len(sequence)
+    except TypeError:
+        if is_indexable:
+            raise
+        length = None
+
+    if comm.size == 1:
+        # No one-sided communication without MPI (e.g. the dummy
+        # communicator), the only process processes everything.
+        if progress_bar:
+            from tqdm import tqdm
+            yield from tqdm(sequence, total=length)
+        else:
+            yield from sequence
+        return
+
+    memory = array('q', [0]) if comm.rank == root else None
+    win = MPI.Win.Create(memory, disp_unit=array('q').itemsize, comm=comm)
+    win.Lock_all()
+
+    increment, result = array('q', [chunk_size]), array('q', [0])
+
+    def claim():
+        win.Fetch_and_op(increment, result, root, op=MPI.SUM)
+        win.Flush(root)
+        return result[0]
+
+    pbar = None
+    if progress_bar and comm.rank == root:
+        from tqdm import tqdm
+        pbar = tqdm(total=length, desc='SharedCounter')
+
+    def update(claimed):
+        if pbar is not None:
+            if length is not None:
+                claimed = min(claimed, length)
+            pbar.update(claimed - pbar.n)
+
+    try:
+        if is_indexable:
+            while True:
+                start = claim()
+                update(start)
+                if start >= length:
+                    break
+                for index in range(start, min(start + chunk_size, length)):
+                    yield sequence[index]
+        else:
+            iterator = iter(sequence)
+            position = 0
+            while True:
+                start = claim()
+                update(start)
+                # Skip the items of the other processes.
+                collections.deque(itertools.islice(iterator, start - position), maxlen=0)
+                position = start
+                for item in itertools.islice(iterator, chunk_size):
+                    position += 1
+                    yield item
+                if position < start + chunk_size:
+                    # The sequence is exhausted.
+                    break
+        if pbar is not None and length is not None:
+            update(length)
+    finally:
+        if pbar is not None:
+            pbar.close()
+        win.Unlock_all()
+        # Collective, i.e. wait for the other processes.
+        win.Free()
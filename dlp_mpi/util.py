@@ -1,4 +1,5 @@
 import os
+import time
 import logging
 import contextlib
 
@@ -10,11 +11,15 @@ LOG = logging.getLogger('dlp_mpi')
 def progress_bar(
         sequence,
         display_progress_bar,
+        total=None,
 ):
-    try:
-        length = len(sequence)
-    except TypeError:
-        length = None
+    if total is not None:
+        length = total
+    else:
+        try:
+            length = len(sequence)
+        except TypeError:
+            length = None
 
     if display_progress_bar:
         try:
@@ -41,6 +46,87 @@ def progress_bar(
         yield DummyPBar()
 
 
+class Journal:
+    """
+    The completed indices of split_managed and map_unordered (checkpoint),
+    one per line in an append-only file. Only the root writes the file and
+    it syncs the file in batches (fsync), i.e. when the job is killed (e.g.
+    the walltime of SLURM) at most the indices of the last batch are lost
+    and processed again, when the job is resumed.
+
+    A path of None disables the journal.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     path = f'{tmp}/journal'
+    ...     with Journal(path) as journal:
+    ...         journal.add(3)
+    ...         journal.add(1)
+    ...     with open(path, 'a') as f:
+    ...         _ = f.write('2')  # An incomplete line, e.g. killed while writing
+    ...     before = Journal.load(path)
+    ...     with Journal(path, resume=True) as journal:
+    ...         journal.add(4)
+    ...     before, Journal.load(path)
+    ({1, 3}, {1, 3, 4})
+    """
+    def __init__(self, path, resume=False, batch_size=1000, interval=1):
+        # Without resume, the journal starts empty.
+        self.file = None if path is None else open(path, 'a' if resume else 'w')
+        self.batch_size = batch_size
+        self.interval = interval
+        self.unsynced = 0
+        self.synced = time.monotonic()
+
+    @staticmethod
+    def load(path):
+        """
+        The completed indices. An incomplete last line is removed from the
+        file, so the next index starts on a new line.
+        """
+        try:
+            with open(path, 'r+b') as f:
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    f.truncate(end)
+        except FileNotFoundError:
+            return set()
+        return {int(line) for line in data[:end].splitlines()}
+
+    def add(self, index):
+        self.extend([index])
+
+    def extend(self, indices):
+        if self.file is None:
+            return
+        lines = ''.join([f'{index}\n' for index in indices])
+        self.file.write(lines)
+        self.unsynced += lines.count('\n')
+        if self.unsynced >= self.batch_size or time.monotonic() - self.synced >= self.interval:
+            self.sync()
+
+    def sync(self):
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def ensure_single_thread_numeric():
     """
     When you parallelize your input pipeline you often want each worker to work
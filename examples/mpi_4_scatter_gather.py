@@ -6,18 +6,24 @@ python mpi_4_scatter_gather.py
 # When you have MPI:
 mpiexec -np 3 python mpi_4_scatter_gather.py
 """
-from itertools import islice
-from dlp_mpi import COMM, RANK, SIZE, MASTER, IS_MASTER
+from dlp_mpi import RANK, SIZE, MASTER, IS_MASTER, scatter, gather
 
 if __name__ == '__main__':
     workload = [10, 11, 12, 13]
 
+    if IS_MASTER:
+        # One job split for each process.
+        splits = [workload[rank::SIZE] for rank in range(SIZE)]
+    else:
+        splits = None
+    split = scatter(splits, root=MASTER)
+
     result = list()
-    for data in islice(workload, RANK, None, SIZE):
+    for data in split:
         print(f'rank={RANK}, size={SIZE}, data={data!r}')
         result.append(2 * data)
 
-    total = COMM.gather(result, root=MASTER)
+    total = gather(result, root=MASTER)
 
     if IS_MASTER:
         print('job splits:', total)
@@ -0,0 +1,94 @@
+"""
+Benchmark for the broadcast: Time of a bcast vs the number of ranks.
+
+Compares
+ - per destination: The root sends the object to each rank individually,
+   i.e. the object is serialized for each destination. That was the
+   behaviour of the AME broadcast, before it serialized only once.
+ - bcast: `COMM.bcast`, which serializes the object once.
+
+Usage:
+    python tests/benchmark_bcast.py  # Launches itself with different sizes
+    python tests/benchmark_bcast.py --sizes 2 4 8 16 --backend ame
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+
+def get_obj():
+    # Something like a config or a dataset index, i.e. many small python
+    # objects, where the serialization is expensive.
+    return {
+        f'example_{i}': {
+            'audio_path': f'/net/db/corpus/audio/example_{i}.wav',
+            'num_samples': 16000 + i,
+            'speaker_id': f'spk{i % 100}',
+        }
+        for i in range(100_000)
+    }
+
+
+def worker(repetitions):
+    import dlp_mpi
+    from dlp_mpi import COMM, SIZE, IS_MASTER
+
+    obj = get_obj() if IS_MASTER else None
+
+    def per_destination():
+        if IS_MASTER:
+            for dest in range(1, SIZE):
+                COMM.send(obj, dest)
+        else:
+            COMM.recv(source=0)
+
+    def bcast():
+        COMM.bcast(obj)
+
+    timings = {}
+    for name, fn in [('per destination', per_destination), ('bcast', bcast)]:
+        elapsed = []
+        for _ in range(repetitions):
+            dlp_mpi.barrier()
+            start = time.perf_counter()
+            fn()
+            dlp_mpi.barrier()
+            elapsed.append(time.perf_counter() - start)
+        timings[name] = min(elapsed)
+
+    if IS_MASTER:
+        print(f'{SIZE:>5} {timings["per destination"]:>17.3f}s {timings["bcast"]:>8.3f}s', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2, 4, 8, 16])
+    parser.add_argument('--backend', default='ame')
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.repetitions)
+        return
+
+    env = dict(os.environ, DLP_MPI_BACKEND=args.backend)
+    env.setdefault('OMP_NUM_THREADS', '1')
+    env.setdefault('MKL_NUM_THREADS', '1')
+
+    print(' size   per destination    bcast')
+    for size in args.sizes:
+        if args.backend == 'ame':
+            launcher = [sys.executable, '-m', 'dlp_mpi.ame.mpirun', '-np', str(size)]
+        else:
+            launcher = ['mpiexec', '--oversubscribe', '-np', str(size)]
+        subprocess.run([
+            *launcher, sys.executable, __file__,
+            '--worker', '--repetitions', str(args.repetitions),
+        ], env=env, check=True)
+
+
+if __name__ == '__main__':
+    main()
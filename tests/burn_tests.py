@@ -5,6 +5,7 @@ import shlex
 import pytest
 import os
 import sys
+import textwrap
 
 
 examples_folder = Path(__file__).parent.parent / 'examples'
@@ -229,3 +230,57 @@ def mpi_5_3(backend, size=3):
         "['h', 'l', 'l', 'e', 'o']\n###" in outputs[0],
         "['h', 'l', 'l', 'o', 'e']\n###" in outputs[0],
     ]), outputs[0]
+
+
+def lost_worker(backend='ame', size=3):
+    """
+    A worker dies without an exception (os._exit like a killed process),
+    the master assigns its indices to the other worker. Only ame detects
+    lost processes, with mpi4py a lost process aborts the job.
+
+    >>> lost_worker('ame')
+    0: done
+    1:
+    2: [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+    """
+    code = textwrap.dedent('''
+        import os
+        import time
+        import dlp_mpi
+
+        processed = []
+        for i in dlp_mpi.split_managed(range(10), progress_bar=False):
+            if dlp_mpi.RANK == 1:
+                os._exit(0)
+            processed.append(i)
+            time.sleep(0.01)
+        print('done' if dlp_mpi.IS_MASTER else sorted(processed))
+    ''')
+    for rank, output in enumerate(exec_code(code, size=size, backend=backend)):
+        print(f'{rank}: {output}'.strip())
+
+
+def lost_worker_map_unordered(backend='ame', size=3):
+    """
+    >>> lost_worker_map_unordered('ame')
+    0: [0, 1, 4, 9, 16, 25, 36, 49, 64, 81]
+    1:
+    2:
+    """
+    code = textwrap.dedent('''
+        import os
+        import time
+        import dlp_mpi
+
+        def square(i):
+            if dlp_mpi.RANK == 1:
+                os._exit(0)
+            time.sleep(0.01)
+            return i * i
+
+        results = list(dlp_mpi.map_unordered(square, range(10)))
+        if dlp_mpi.IS_MASTER:
+            print(sorted(results))
+    ''')
+    for rank, output in enumerate(exec_code(code, size=size, backend=backend)):
+        print(f'{rank}: {output}'.strip())
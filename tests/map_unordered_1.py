@@ -105,9 +105,12 @@ def worker_fails():
     if dlp_mpi.IS_MASTER:
         assert ranks == [0, 1, 2], ranks
 
+    failed = []
+
     def bar(i):
         if RANK == 1:
             print(f'let {RANK} fail for data {i}')
+            failed.append(i)
             raise ValueError('failed')
         assert dlp_mpi.RANK in [1, 2], (dlp_mpi.RANK, dlp_mpi.SIZE)
         return i, RANK
@@ -115,9 +118,6 @@ def worker_fails():
     processed = []
     try:
         dlp_mpi.barrier()
-        if RANK == 2:
-            # Delay rank 2, this ensures that rank 1 gets the first example
-            time.sleep(0.1)
         for i, worker_rank in dlp_mpi.map_unordered(
                 bar,
                 examples
@@ -129,12 +129,153 @@ def worker_fails():
         assert RANK in [1], RANK
     except AssertionError:
         assert RANK in [0], RANK
-        # Example zero failed for worker 1, but the master process fails at the
-        # end of the for loop. So examples 1 to 4 are processed
-        assert processed == [1, 2, 3, 4], processed
     else:
         assert RANK in [2], RANK
 
+    # One example failed for worker 1, but the master process fails at the
+    # end of the for loop. So the other examples are processed. Which
+    # example fails depends on the timing.
+    failed = dlp_mpi.gather(failed)
+    if dlp_mpi.IS_MASTER:
+        failed, = failed[1]
+        assert processed == [i for i in examples if i != failed], (processed, failed)
+
+
+def root_as_worker():
+    print(f'root_as_worker test {RANK}')
+
+    examples = list(range(30))
+
+    def bar(i):
+        time.sleep(0.001)
+        return i, dlp_mpi.RANK
+
+    for indexable in [True, False]:
+        results = list(dlp_mpi.map_unordered(
+            bar,
+            examples if indexable else iter(examples),
+            indexable=indexable,
+            root_as_worker=True,
+        ))
+        if RANK == 0:
+            assert sorted(i for i, _ in results) == examples, results
+            assert {rank for _, rank in results} == {0, 1, 2}, results
+        else:
+            assert results == [], results
+
+    # A failure on the master stops the workers.
+    def fail(i):
+        time.sleep(0.01)
+        if dlp_mpi.RANK == 0:
+            raise ValueError('failed')
+        return i
+
+    try:
+        for _ in dlp_mpi.map_unordered(fail, examples, root_as_worker=True):
+            pass
+    except ValueError:
+        assert RANK == 0, RANK
+    else:
+        assert RANK in [1, 2], RANK
+
+
+def ship_items():
+    print(f'ship_items test {RANK}')
+
+    def examples():
+        assert RANK == 0, RANK  # Only the master iterates.
+        yield from range(30)
+
+    for root_as_worker in [False, True]:
+        results = list(dlp_mpi.map_unordered(
+            lambda i: i * 2,
+            examples(),
+            ship_items=True,
+            root_as_worker=root_as_worker,
+        ))
+        if RANK == 0:
+            assert sorted(results) == list(range(0, 60, 2)), results
+        else:
+            assert results == [], results
+
+
+def retries():
+    print(f'retries test {RANK}')
+
+    examples = list(range(30))
+
+    # The first attempt of each example on rank 1 fails, the example is
+    # processed again on another rank and rank 1 continues.
+    def flaky(i):
+        time.sleep(0.001)
+        if dlp_mpi.RANK == 1:
+            raise OSError('flaky')
+        return i
+
+    results = list(dlp_mpi.map_unordered(flaky, examples, retries=1))
+    if RANK == 0:
+        assert sorted(results) == examples, results
+
+    # Index 13 always fails, the failure is reported instead of raised.
+    def fail(i):
+        if i == 13:
+            raise ValueError('failed')
+        return i
+
+    for kwargs in [dict(), dict(retries=2, root_as_worker=True)]:
+        failures = []
+        results = list(dlp_mpi.map_unordered(fail, examples, failures=failures, **kwargs))
+        if RANK == 0:
+            assert sorted(results) == examples[:13] + examples[14:], results
+            assert len(failures) == 1, failures
+            assert failures[0]['index'] == 13, failures
+            assert len(failures[0]['ranks']) == kwargs.get('retries', 0) + 1, failures
+            assert 'ValueError' in failures[0]['errors'][-1], failures
+        else:
+            assert failures == [], failures
+
+
+def speculative():
+    print(f'speculative test {RANK}')
+
+    examples = list(range(20))
+
+    # Rank 1 is a straggler, rank 2 gets a duplicate of its task at the end
+    # and the late result of rank 1 is discarded.
+    def slow(i):
+        time.sleep(0.3 if dlp_mpi.RANK == 1 else 0.005)
+        return i, dlp_mpi.RANK
+
+    for kwargs in [dict(), dict(ship_items=True)]:
+        results = list(dlp_mpi.map_unordered(slow, examples, speculative=True, **kwargs))
+        if RANK == 0:
+            assert sorted(i for i, _ in results) == examples, (kwargs, results)
+
+
+def journal():
+    print(f'journal test {RANK}')
+    import shutil
+    import tempfile
+
+    examples = list(range(30))
+    tmpdir = dlp_mpi.bcast(tempfile.mkdtemp() if RANK == 0 else None)
+    path = f'{tmpdir}/journal'
+
+    # The first run stops after 20 examples, e.g. the walltime of SLURM.
+    results = list(dlp_mpi.map_unordered(lambda i: i, examples[:20], journal=path))
+
+    for kwargs in [dict(), dict(ship_items=True, root_as_worker=True)]:
+        results = list(dlp_mpi.map_unordered(
+            lambda i: i, examples, journal=path, resume=True, **kwargs))
+        if RANK == 0:
+            assert sorted(results) == examples[20:], (kwargs, results)
+            assert dlp_mpi.util.Journal.load(path) == set(examples)
+            # The next run continues from the first.
+            with open(path, 'w') as f:
+                f.write(''.join(f'{i}\n' for i in range(20)))
+    if RANK == 0:
+        shutil.rmtree(tmpdir)
+
 
 def pbar():
     print(f'executable test {RANK}')
@@ -254,6 +395,16 @@ if __name__ == '__main__':
     dlp_mpi.barrier()
     worker_fails()
     dlp_mpi.barrier()
+    root_as_worker()
+    dlp_mpi.barrier()
+    ship_items()
+    dlp_mpi.barrier()
+    retries()
+    dlp_mpi.barrier()
+    speculative()
+    dlp_mpi.barrier()
+    journal()
+    dlp_mpi.barrier()
     pbar()
     dlp_mpi.barrier()
     overhead()
@@ -108,11 +108,6 @@ def worker_fails():
     processed = []
     try:
         dlp_mpi.barrier()
-        if RANK == 2:
-            # Delay rank 2, this ensures that rank 1 gets the first example
-            # Does no longer work, becasue in split_managed is COMM.Clone
-            # used.
-            time.sleep(0.1)
         for i in dlp_mpi.split_managed(examples, progress_bar=False):
             processed.append(i)
             if RANK == 1:
@@ -121,13 +116,243 @@ def worker_fails():
             assert dlp_mpi.RANK in [1, 2], (dlp_mpi.RANK, dlp_mpi.SIZE)
     except ValueError:
         assert RANK in [1], RANK
-        assert processed in [[0], [1]], processed
+        assert len(processed) == 1, processed
     except AssertionError:
         assert RANK in [0], RANK
         assert processed == [], processed
     else:
         assert RANK in [2], RANK
-        assert processed == [1, 2, 3, 4], processed
+
+    # Which worker gets the first example depends on the timing, hence
+    # check only, that rank 2 processed all examples, that rank 1 did not.
+    processed = dlp_mpi.gather(processed)
+    if dlp_mpi.IS_MASTER:
+        failed, = processed[1]
+        assert processed[2] == [i for i in examples if i != failed], processed
+
+
+def chunked():
+    print(f'chunked test {RANK}')
+
+    examples = list(range(50))
+
+    for kwargs in [
+            dict(schedule='dynamic', chunk_size=7),
+            dict(schedule='guided', chunk_size=2),
+            dict(schedule='guided', is_indexable=False),
+            dict(schedule='dynamic', chunk_size=4, is_indexable=False),
+            dict(prefetch=2),
+            dict(schedule='guided', prefetch=1, is_indexable=False),
+            dict(chunk_size=3, prefetch=1, load_threads=2),
+    ]:
+        processed = []
+        sequence = examples if kwargs.get('is_indexable', True) else iter(examples)
+        for i in dlp_mpi.split_managed(sequence, progress_bar=False, **kwargs):
+            assert dlp_mpi.RANK in [1, 2], (dlp_mpi.RANK, dlp_mpi.SIZE)
+            processed.append(i)
+        processed = dlp_mpi.gather(processed)
+        if RANK == 0:
+            assert processed[0] == [], processed
+            assert sorted(processed[1] + processed[2]) == examples, (kwargs, processed)
+
+    # The master reports the exact index, that failed inside a chunk.
+    try:
+        for i in dlp_mpi.split_managed(examples, progress_bar=False, chunk_size=5, prefetch=1, load_threads=1):
+            if i == 13:
+                raise ValueError('failed')
+    except ValueError:
+        assert RANK in [1, 2], RANK
+    except AssertionError as e:
+        assert RANK == 0, RANK
+        assert 'failed for index 13' in str(e), e
+    else:
+        assert RANK in [1, 2], RANK
+
+
+def root_as_worker():
+    print(f'root_as_worker test {RANK}')
+
+    examples = list(range(50))
+
+    for kwargs in [
+            dict(),
+            dict(schedule='guided', prefetch=1),
+            dict(chunk_size=3, is_indexable=False),
+    ]:
+        processed = []
+        sequence = examples if kwargs.get('is_indexable', True) else iter(examples)
+        for i in dlp_mpi.split_managed(
+                sequence, progress_bar=False, root_as_worker=True, **kwargs):
+            processed.append(i)
+            time.sleep(0.001)
+        processed = dlp_mpi.gather(processed)
+        if RANK == 0:
+            assert len(processed[0]) > 0, processed
+            assert sorted(sum(processed, [])) == examples, (kwargs, processed)
+
+    # A failure on the master stops the workers.
+    processed = []
+    try:
+        for i in dlp_mpi.split_managed(
+                examples, progress_bar=False, root_as_worker=True):
+            processed.append(i)
+            time.sleep(0.01)
+            if RANK == 0:
+                raise ValueError('failed')
+    except ValueError:
+        assert RANK == 0, RANK
+        assert len(processed) == 1, processed
+    else:
+        assert RANK in [1, 2], RANK
+        assert len(processed) < 10, processed
+
+
+def ship_items():
+    print(f'ship_items test {RANK}')
+
+    def examples():
+        assert RANK == 0, RANK  # Only the master iterates.
+        yield from range(50)
+
+    for kwargs in [
+            dict(),
+            dict(chunk_size=4, prefetch=1),
+            dict(root_as_worker=True),
+    ]:
+        processed = []
+        for i in dlp_mpi.split_managed(
+                examples(), progress_bar=False, ship_items=True, **kwargs):
+            processed.append(i)
+        processed = dlp_mpi.gather(processed)
+        if RANK == 0:
+            assert sorted(sum(processed, [])) == list(range(50)), (kwargs, processed)
+
+
+def cost():
+    print(f'cost test {RANK}')
+
+    examples = list(range(20))
+
+    for kwargs in [
+            dict(cost=examples),
+            dict(cost=lambda example: example, chunk_size=2, prefetch=1),
+            dict(cost=examples, root_as_worker=True),
+    ]:
+        processed = []
+        for i in dlp_mpi.split_managed(examples, progress_bar=False, **kwargs):
+            processed.append(i)
+        processed = dlp_mpi.gather(processed)
+        if RANK == 0:
+            assert sorted(sum(processed, [])) == examples, (kwargs, processed)
+            # The most expensive first, i.e. each rank processes its items
+            # in descending order.
+            for p in processed:
+                assert p == sorted(p, reverse=True), (kwargs, processed)
+
+
+def retries():
+    print(f'retries test {RANK}')
+
+    examples = list(range(30))
+
+    # The first example of rank 1 fails, it is processed again on rank 2.
+    processed = []
+    try:
+        for i in dlp_mpi.split_managed(
+                examples, progress_bar=False, retries=1, chunk_size=2):
+            if RANK == 1:
+                raise ValueError('failed')
+            processed.append(i)
+            time.sleep(0.001)
+    except ValueError:
+        assert RANK == 1, RANK
+    processed = dlp_mpi.gather(processed)
+    if RANK == 0:
+        assert sorted(sum(processed, [])) == examples, processed
+
+    # Index 13 always fails, the failure is reported instead of raised.
+    failures = []
+    processed = []
+    try:
+        for i in dlp_mpi.split_managed(
+                examples, progress_bar=False, failures=failures):
+            if i == 13:
+                raise ValueError('failed')
+            processed.append(i)
+            time.sleep(0.001)
+    except ValueError:
+        assert RANK in [1, 2], RANK
+    processed = dlp_mpi.gather(processed)
+    if RANK == 0:
+        assert len(failures) == 1 and failures[0]['index'] == 13, failures
+        assert sorted(sum(processed, [])) == examples[:13] + examples[14:], processed
+    else:
+        assert failures == [], failures
+
+
+def speculative():
+    print(f'speculative test {RANK}')
+
+    examples = list(range(20))
+
+    # Rank 1 is a straggler with prefetched indices. At the end, rank 2
+    # gets duplicates and rank 1 skips the indices, that rank 2 processed.
+    processed = []
+    for i in dlp_mpi.split_managed(
+            examples, progress_bar=False, speculative=True, prefetch=2):
+        processed.append(i)
+        time.sleep(0.1 if RANK == 1 else 0.005)
+    processed = dlp_mpi.gather(processed)
+    if RANK == 0:
+        assert set(sum(processed, [])) == set(examples), processed
+        assert len(processed[1]) < 5, processed
+
+
+def journal():
+    print(f'journal test {RANK}')
+    import shutil
+    import tempfile
+
+    examples = list(range(30))
+    tmpdir = dlp_mpi.bcast(tempfile.mkdtemp() if RANK == 0 else None)
+    path = f'{tmpdir}/journal'
+
+    # The first run stops after 20 examples, e.g. the walltime of SLURM.
+    for i in dlp_mpi.split_managed(examples[:20], progress_bar=False, journal=path):
+        time.sleep(0.001)
+
+    processed = []
+    for i in dlp_mpi.split_managed(
+            examples, progress_bar=False, journal=path, resume=True,
+            chunk_size=3, cost=examples):
+        processed.append(i)
+        time.sleep(0.001)
+    processed = dlp_mpi.gather(processed)
+    if RANK == 0:
+        assert sorted(sum(processed, [])) == examples[20:], processed
+        assert dlp_mpi.util.Journal.load(path) == set(examples)
+        shutil.rmtree(tmpdir)
+
+
+def shared_counter():
+    print(f'shared_counter test {RANK}')
+
+    examples = list(range(50))
+
+    for kwargs in [
+            dict(),
+            dict(chunk_size=4),
+            dict(chunk_size=3, is_indexable=False),
+    ]:
+        processed = []
+        sequence = examples if kwargs.get('is_indexable', True) else iter(examples)
+        for i in dlp_mpi.split_shared_counter(sequence, **kwargs):
+            processed.append(i)
+            time.sleep(0.001)
+        processed = dlp_mpi.gather(processed)
+        if RANK == 0:
+            assert all(len(p) > 0 for p in processed), (kwargs, processed)
+            assert sorted(sum(processed, [])) == examples, (kwargs, processed)
 
 
 def pbar():
@@ -251,6 +476,22 @@ if __name__ == '__main__':
     dlp_mpi.barrier()
     worker_fails()
     dlp_mpi.barrier()
+    chunked()
+    dlp_mpi.barrier()
+    root_as_worker()
+    dlp_mpi.barrier()
+    ship_items()
+    dlp_mpi.barrier()
+    cost()
+    dlp_mpi.barrier()
+    speculative()
+    dlp_mpi.barrier()
+    journal()
+    dlp_mpi.barrier()
+    retries()
+    dlp_mpi.barrier()
+    shared_counter()
+    dlp_mpi.barrier()
     pbar()
     dlp_mpi.barrier()
     overhead()